@@ -1,3 +1,5 @@
+import os
+import sys
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -7,28 +9,59 @@ import numpy as np
 from matplotlib import pyplot
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import TfidfVectorizer
 from nltk.corpus import stopwords
-from nltk import word_tokenize
 from sklearn.metrics import accuracy_score, confusion_matrix, precision_score, recall_score, classification_report
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from workers import parallel_map
+from sparse_features import csr_to_torch, sparse_loader
+from feature_cache import tfidf_features
 
-def preprocess_pandas(data, columns):
-    df_ = pd.DataFrame(columns=columns)
-    data['Sentence'] = data['Sentence'].str.lower()
-    data['Sentence'] = data['Sentence'].replace('[a-zA-Z0-9-_.]+@[a-zA-Z0-9-_.]+', '', regex=True)                      # remove emails
-    data['Sentence'] = data['Sentence'].replace('((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)(\.|$)){4}', '', regex=True)    # remove IP address
-    data['Sentence'] = data['Sentence'].str.replace('[^\w\s]','')                                                       # remove special characters
-    data['Sentence'] = data['Sentence'].replace('\d', '', regex=True)                                                   # remove numbers
-    for index, row in data.iterrows():
-        word_tokens = word_tokenize(row['Sentence'])
-        filtered_sent = [w for w in word_tokens if not w in stopwords.words('english')]
-        df_ = df_.append({
-            "index": row['index'],
-            "Class": row['Class'],
-            "Sentence": " ".join(filtered_sent[0:])
-        }, ignore_index=True)
+FEATURE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature-cache')
+
+STOPWORDS = None
+
+def stopword_set():
+    """The English stopwords, as a frozenset (built once)."""
+    global STOPWORDS
+    if STOPWORDS is None:
+        STOPWORDS = frozenset(stopwords.words('english'))
+    return STOPWORDS
+
+def clean_sentences(sentences):
+    """The cleaning steps, on a whole Series of sentences at a time."""
+    sentences = sentences.fillna('').str.lower()
+    sentences = sentences.str.replace(r'[a-zA-Z0-9-_.]+@[a-zA-Z0-9-_.]+', '', regex=True)                   # remove emails
+    sentences = sentences.str.replace(r'((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)(\.|$)){4}', '', regex=True)  # remove IP address
+    return sentences.str.replace(r'[^\w\s]|\d', '', regex=True)                                             # remove special characters and numbers
+
+def _preprocess_chunk(data, columns):
+    """
+    The cleaned sentences only have word characters and whitespace left, so
+    splitting on whitespace gives the tokens `word_tokenize` gave (a lot
+    faster), except that NLTK also splits a few words like 'cannot' and
+    'gonna' in two. (`tokenizer.Tokenizer` is for raw reddit text: it would
+    take the underscores in 'snake_case' for markdown.)
+    """
+    stop = stopword_set()
+    sentences = clean_sentences(data['Sentence']).str.split()                                               # tokenize
+    filtered = [' '.join([w for w in words if w not in stop]) for words in sentences]                       # remove stopwords
+    data = data[columns].copy()
+    data['Sentence'] = filtered
     return data
 
+def preprocess_pandas(data, columns, workers=1, chunksize=100000):
+    """
+    Returns a new frame with the given columns of data, and the sentences
+    cleaned, tokenized and without stopwords. With workers > 1, frames with
+    more than chunksize rows are split into chunks, which are preprocessed
+    in a pool of that many processes.
+    """
+    if workers <= 1 or len(data) <= chunksize:
+        return _preprocess_chunk(data, columns)
+    stopword_set()                                                      # load once, before forking the workers
+    chunks = (data.iloc[i:i + chunksize] for i in range(0, len(data), chunksize))
+    return pd.concat(parallel_map(lambda chunk: _preprocess_chunk(chunk, columns), chunks, workers, chunksize=1))
+
 # If this is the primary file that is executed (ie not an import of another file)
 if __name__ == "__main__":
     # get data, pre-process and split
@@ -46,13 +79,15 @@ if __name__ == "__main__":
     )
 
     # vectorize data using TFIDF and transform for PyTorch for scalability
-    word_vectorizer = TfidfVectorizer(analyzer='word', ngram_range=(1,2), max_features=50000, max_df=0.5, use_idf=True, norm='l2')
-    training_data = word_vectorizer.fit_transform(training_data)        # transform texts to sparse matrix
-    training_data = training_data.todense()                             # convert to dense matrix for Pytorch
+    # (the fitted vectorizer and the sparse matrices are cached in FEATURE_CACHE, keyed by the texts and parameters)
+    word_vectorizer, (training_data, validation_data) = tfidf_features(  # transform texts to sparse matrices (kept sparse: dense would be rows x vocab)
+        FEATURE_CACHE, training_data, validation_data,
+        analyzer='word', ngram_range=(1,2), max_features=50000, max_df=0.5, use_idf=True, norm='l2', dtype=np.float32
+    )
     vocab_size = len(word_vectorizer.vocabulary_)
-    validation_data = word_vectorizer.transform(validation_data)
-    validation_data = validation_data.todense()
-    train_x_tensor = torch.from_numpy(np.array(training_data)).type(torch.FloatTensor)
+    train_x_tensor = csr_to_torch(training_data)                        # sparse COO tensors, for torch.sparse.mm
     train_y_tensor = torch.from_numpy(np.array(training_labels)).long()
-    validation_x_tensor = torch.from_numpy(np.array(validation_data)).type(torch.FloatTensor)
+    validation_x_tensor = csr_to_torch(validation_data)
     validation_y_tensor = torch.from_numpy(np.array(validation_labels)).long()
+    train_loader = sparse_loader(training_data, training_labels, batch_size=64)                  # or dense mini-batches, densified one at a time
+    validation_loader = sparse_loader(validation_data, validation_labels, batch_size=64, shuffle=False)
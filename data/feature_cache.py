@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+"""
+A cache of fitted TF-IDF features, so that runs over the same texts don't
+have to fit the vectorizer and transform all the texts again.
+
+The cache for a set of texts and vectorizer parameters is a directory named
+after a hash of both, with:
+- `terms.npy`: the vocabulary, with each term at its column index,
+- `idf.npy`: the IDF weights,
+- `matrix-N.{data,indices,indptr}.npy`: the arrays of each CSR matrix,
+- `meta.json`: the parameters and the shapes of the matrices.
+These are separate `.npy` files rather than one `.npz`, since `np.load` can
+only memory-map the former: loading is then almost instant, and the matrices
+are only read from disk as they are used (they are read-only).
+
+Any change to the texts (or their order), the parameters or the version of
+scikit-learn gives a different hash, so stale caches are simply not used.
+"""
+
+def cache_key(texts, params):
+    """A hash of the texts (each of the lists of texts, in order) and the parameters."""
+    h = hashlib.sha1(json.dumps([params, sklearn.__version__], sort_keys=True, default=str).encode('utf-8'))
+    for part in texts:
+        for text in part:
+            h.update(text.encode('utf-8', 'surrogatepass'))
+            h.update(b'\0')
+        h.update(b'\1')
+    return h.hexdigest()[:16]
+
+def cache_dir_for(cache_dir, key):
+    return os.path.join(cache_dir, 'tfidf-' + key)
+
+def _save(path, params, vectorizer, matrices):
+    """Save to a temporary directory first, which is put in place at the end."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp' + str(os.getpid())
+    try:
+        os.makedirs(tmp)
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        np.save(os.path.join(tmp, 'terms.npy'), np.array(terms, dtype=str))
+        np.save(os.path.join(tmp, 'idf.npy'), vectorizer.idf_)
+        for (i, matrix) in enumerate(matrices):
+            matrix = matrix.tocsr()
+            for name in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(tmp, 'matrix-%d.%s.npy' % (i, name)), getattr(matrix, name))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'params': params, 'shapes': [m.shape for m in matrices]}, f, default=str)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Another process got there first (with the same results).
+            if not os.path.exists(path):
+                raise
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+def _load(path, params):
+    """The vectorizer and the (memory-mapped) matrices saved at path."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+    vectorizer = TfidfVectorizer(**params)
+    vectorizer.vocabulary_ = {term: i for (i, term) in enumerate(load('terms.npy').tolist())}
+    vectorizer.idf_ = np.array(load('idf.npy'))
+    matrices = []
+    for (i, shape) in enumerate(meta['shapes']):
+        arrays = tuple(load('matrix-%d.%s.npy' % (i, name)) for name in ('data', 'indices', 'indptr'))
+        matrices.append(sp.csr_matrix(arrays, shape=tuple(shape), copy=False))
+    return (vectorizer, matrices)
+
+def tfidf_features(cache_dir, fit_texts, *other_texts, **params):
+    """
+    Fit a `TfidfVectorizer(**params)` to fit_texts, and transform fit_texts
+    and each of other_texts with it. Returns the vectorizer and the list of
+    (CSR) matrices. If cache_dir has the results for the same texts and
+    parameters, they are loaded from there, otherwise they are saved there.
+    With cache_dir None, there is no caching.
+    """
+    if cache_dir is not None:
+        path = cache_dir_for(cache_dir, cache_key((fit_texts,) + other_texts, params))
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return _load(path, params)
+    vectorizer = TfidfVectorizer(**params)
+    matrices = [vectorizer.fit_transform(fit_texts)] + [vectorizer.transform(texts) for texts in other_texts]
+    if cache_dir is not None:
+        _save(path, params, vectorizer, matrices)
+    return (vectorizer, matrices)
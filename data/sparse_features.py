@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
+
+"""
+Feeding sparse features (like the CSR matrix from `TfidfVectorizer`) to
+PyTorch without `todense()`.
+
+A dense matrix needs rows x vocabulary floats: for millions of comments and a
+vocabulary of 50000 that is hundreds of GB, while a TF-IDF row only has a
+few dozen non-zeros. Both ways below need memory for the non-zeros only:
+- `csr_to_torch` converts the whole matrix to a sparse COO tensor, which
+  `torch.sparse.mm` (or a first `nn.Linear` layer via `torch.sparse.mm(x, W.t())`)
+  can use directly.
+- `SparseDataset` (with `sparse_loader`) keeps the CSR matrix, and only
+  densifies one mini-batch of rows at a time, for models that want dense
+  input.
+"""
+
+def csr_to_torch(matrix, dtype=torch.float32):
+    """A scipy sparse matrix as a (coalesced) torch sparse COO tensor."""
+    coo = matrix.tocoo()
+    indices = torch.from_numpy(np.vstack([coo.row, coo.col]).astype(np.int64))
+    values = torch.from_numpy(coo.data).to(dtype)
+    return torch.sparse_coo_tensor(indices, values, coo.shape).coalesce()
+
+class SparseDataset(Dataset):
+    """
+    The rows of a sparse matrix, with their labels. Indexing it with a list
+    of row numbers (which is what `sparse_loader` does) returns those rows
+    as one dense (batch x columns) tensor, and a tensor of their labels.
+    """
+
+    def __init__(self, features, labels, dtype=torch.float32):
+        self.features = features.tocsr()
+        self.labels = torch.as_tensor(np.asarray(labels))
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def __getitem__(self, rows):
+        batch = torch.from_numpy(self.features[rows].toarray()).to(self.dtype)
+        return (batch, self.labels[rows])
+
+def sparse_loader(features, labels, batch_size=64, shuffle=True, **options):
+    """
+    A DataLoader over the rows of a sparse matrix (and their labels), which
+    yields (dense batch, labels) pairs. Rows are taken from the CSR matrix
+    in one slice per batch, rather than one by one and stacked. Further
+    options are passed on to DataLoader (like num_workers).
+    """
+    dataset = SparseDataset(features, labels)
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    batches = BatchSampler(sampler, batch_size, drop_last=False)
+    return DataLoader(dataset, sampler=batches, batch_size=None, **options)
@@ -0,0 +1,54 @@
+"""
+Benchmark for the text normalization: the separate steps (`keep_alnum`,
+`strip_digits`, `trim_whitespace`, `str.lower`, `str.split`, one pass each)
+against `compile_normalizer` (one pass), on the sentences in the data
+directory, for a few combinations of options.
+
+    $ python3 bench/bench_normalize.py [repeat]
+"""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from data_loader import (compile_normalizer, keep_alnum, preprocessor_pipeline, strip_digits,
+                         trim_whitespace)
+
+DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'amazon_cells_labelled.txt')
+
+OPTIONS = ['strip_specials', 'strip_digits', 'trim_whitespace', 'to_lower', 'tokenize']
+
+COMBINATIONS = [
+    OPTIONS,
+    ['strip_specials', 'trim_whitespace', 'to_lower'],
+    ['strip_specials', 'strip_digits'],
+    ['to_lower', 'tokenize'],
+]
+
+def sentences():
+    with open(DATA, encoding='utf-8') as f:
+        return [line.split('\t')[0] for line in f]
+
+def separate_steps(options):
+    steps = {'strip_specials': keep_alnum(), 'strip_digits': strip_digits(),
+             'trim_whitespace': trim_whitespace(), 'to_lower': str.lower, 'tokenize': str.split}
+    return preprocessor_pipeline([steps[option] for option in OPTIONS if option in options])
+
+def run(f, texts):
+    start = time.perf_counter()
+    for text in texts:
+        f(text)
+    return time.perf_counter() - start
+
+def main(repeat):
+    texts = sentences() * repeat
+    print(f'{len(texts)} sentences')
+    for options in COMBINATIONS:
+        separate = separate_steps(options)
+        fused = compile_normalizer(**{option: True for option in options})
+        assert all(separate(text) == fused(text) for text in texts)
+        (slow, fast) = (run(separate, texts), run(fused, texts))
+        print(f'{" ".join(options):62} separate: {slow:.3f}s  fused: {fast:.3f}s  '
+              f'speedup: {slow / fast:.2f}x')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
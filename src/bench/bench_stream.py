@@ -0,0 +1,54 @@
+"""
+Micro-benchmark for Stream fusion: the same 10-step pipeline (similar to what
+`reddit_loader._main` builds) with fused loops and with a chain of generators.
+
+    $ python3 bench/bench_stream.py [n]
+"""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from stream import Stream
+from util import nop, wrap
+
+def comments(n):
+    return ({'id': 'c' + str(i), 'body': 'hello world', 'subreddit': 'programming'}
+            for i in range(n))
+
+def pipeline(n):
+    return (Stream(comments(n))
+            .take(n)
+            .filter(lambda c: c['body'] != '[deleted]')
+            .take(n)
+            .filter(lambda c: c['subreddit'] != 'nsfw')
+            .filter(nop)
+            .map(nop)
+            .map(wrap(str.lower))
+            .filter(lambda c: len(c['body']) >= 1)
+            .filter(lambda c: len(c['body']) <= 1000)
+            .peek(nop))
+
+def run(n, fusion, terminal):
+    Stream.fusion = fusion
+    start = time.perf_counter()
+    terminal(pipeline(n))
+    return time.perf_counter() - start
+
+def main(n):
+    # The baseline for the overhead: just creating the records.
+    start = time.perf_counter()
+    for _ in comments(n):
+        pass
+    base = time.perf_counter() - start
+    print(f'{n} records, {base:.3f}s just to create them')
+    terminals = [('count', Stream.count), ('foreach', lambda s: s.foreach(nop)),
+                 ('to_list', Stream.to_list)]
+    for (name, terminal) in terminals:
+        chained = run(n, False, terminal)
+        fused = run(n, True, terminal)
+        print(f'{name:8} chained: {chained:.3f}s  fused: {fused:.3f}s  '
+              f'speedup: {chained / fused:.2f}x  '
+              f'(excluding record creation: {(chained - base) / (fused - base):.2f}x)')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,185 @@
+"""
+Generates synthetic reddit comment dumps, like the RC_* files from
+pushshift.io: one JSON object per line, with the same fields, in order of
+creation. The same arguments always give the same file.
+
+Each month (--month, or the one in the name of the file) has its own range
+of comment and post IDs, and starts at the start of that month, so the files
+of different months can be used together (like the real ones).
+
+Comments are spread over a window of open posts (threads), and reply to one
+of the recent comments of their post, so threads are interleaved in time the
+way they are in the real data. The bodies are words from a Zipf-distributed
+vocabulary, with now and then a URL, markdown, an emoticon or a quote.
+
+    $ python3 bench/gen_comments.py [-n N] [--bz2] [options] RC_2006-01
+"""
+import argparse
+import bz2
+import calendar
+import itertools
+import json
+import os
+import random
+import re
+
+# The IDs of 2006-01. Each month after that starts ID_STRIDE further.
+ID_START = int('c00000', 36)
+POST_ID_START = int('1000', 36)
+ID_STRIDE = 36 ** 5
+FIRST_MONTH = (2006, 1)
+EMOTICONS = [':)', ':(', ':D', ';)', ':P', '<3', 'xD', '^_^']
+MARKDOWN = ['**{}**', '*{}*', '~~{}~~', '`{}`']
+
+def base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    s = ''
+    while n:
+        (n, d) = divmod(n, 36)
+        s = digits[d] + s
+    return s or '0'
+
+def month_start(month):
+    """The first comment ID, the first post ID and the start time of month (year, month)."""
+    (year, m) = month
+    index = (year - FIRST_MONTH[0]) * 12 + m - FIRST_MONTH[1]
+    if index < 0:
+        raise ValueError('months start at %d-%02d' % FIRST_MONTH)
+    return (ID_START + index * ID_STRIDE, POST_ID_START + index * ID_STRIDE,
+            calendar.timegm((year, m, 1, 0, 0, 0)))
+
+def parse_month(s):
+    """(year, month) from 'YYYY-MM'."""
+    (year, month) = s.split('-')
+    return (int(year), int(month))
+
+def file_month(path):
+    """The month in a file name like RC_2006-01(.bz2), or None."""
+    match = re.match(r'RC_(\d{4}-\d{2})\b', os.path.basename(path))
+    return parse_month(match.group(1)) if match else None
+
+def make_vocabulary(rng, size, zipf=1.1):
+    """Random words, and cumulative Zipf weights for sampling them (most frequent first)."""
+    words = set()
+    while len(words) < size:
+        syllables = rng.choice([1, 1, 2, 2, 2, 3, 3, 4])
+        words.add(''.join(rng.choice('tnsrhldcmfpgwybvk') + rng.choice('aeiouy') + rng.choice(['', '', 'n', 's', 'r', 't'])
+                          for _ in range(syllables)))
+    words = sorted(words, key=lambda w: (len(w), w))
+    weights = itertools.accumulate(1 / (rank ** zipf) for rank in range(1, size + 1))
+    return (words, list(weights))
+
+def make_body(rng, words, weights, mean_words):
+    n = max(1, int(rng.expovariate(1 / mean_words)))
+    tokens = rng.choices(words, cum_weights=weights, k=n)
+    tokens[0] = tokens[0].capitalize()
+    r = rng.random()
+    if r < 0.05:
+        tokens.insert(rng.randrange(n + 1), 'https://www.example.com/' + rng.choice(words))
+    elif r < 0.1:
+        i = rng.randrange(n)
+        tokens[i] = rng.choice(MARKDOWN).format(tokens[i])
+    elif r < 0.15:
+        tokens.append(rng.choice(EMOTICONS))
+    body = ' '.join(tokens) + rng.choice('.......?!')
+    if rng.random() < 0.05:
+        body = '&gt; ' + body + '\n\n' + make_body(rng, words, weights, mean_words)
+    return body
+
+def generate(n, seed=0, month=FIRST_MONTH, subreddits=50, open_posts=200, comments_per_post=20, reply_prob=0.6,
+             recent=20, vocabulary=20000, mean_words=15, deleted_rate=0.05, comments_per_second=1.0):
+    """
+    Yields n comments (dicts) of month. Each comment is in a new post with
+    probability 1 / comments_per_post (the oldest of open_posts posts is then
+    closed), otherwise in one of the open posts. It replies to one of the
+    last recent comments of its post with probability reply_prob (else to
+    the post).
+    """
+    if n > ID_STRIDE:
+        raise ValueError('at most %d comments per month' % ID_STRIDE)
+    (first_id, next_post, now) = month_start(month)
+    rng = random.Random(seed)
+    (words, weights) = make_vocabulary(rng, vocabulary)
+    subreddit_names = ['reddit.com', 'programming', 'science', 'politics', 'pics']
+    subreddit_names += ['sub' + base36(i) for i in range(max(0, subreddits - len(subreddit_names)))]
+    subreddit_names = subreddit_names[:subreddits]
+    subreddit_weights = list(itertools.accumulate(1 / rank for rank in range(1, subreddits + 1)))
+    authors = max(10, n // 20)
+    posts = []      # open posts: (link_id, subreddit, recent comment IDs)
+    now = float(now)
+    for i in range(n):
+        if not posts or rng.random() < 1 / comments_per_post:
+            subreddit = rng.choices(subreddit_names, cum_weights=subreddit_weights)[0]
+            posts.append(('t3_' + base36(next_post), subreddit, []))
+            next_post += 1
+            if len(posts) > open_posts:
+                posts.pop(0)
+            post = posts[-1]
+        else:
+            post = posts[rng.randrange(len(posts))]
+        (link_id, subreddit, recent_ids) = post
+        if recent_ids and rng.random() < reply_prob:
+            parent_id = 't1_' + rng.choice(recent_ids)
+        else:
+            parent_id = link_id
+        comment_id = base36(first_id + i)
+        recent_ids.append(comment_id)
+        if len(recent_ids) > recent:
+            recent_ids.pop(0)
+        now += rng.expovariate(comments_per_second)
+        deleted = rng.random() < deleted_rate
+        score = int(rng.paretovariate(1.5)) - (1 if rng.random() < 0.1 else 0)
+        yield {
+            'author': '[deleted]' if deleted else 'user' + base36(int(rng.paretovariate(1.0) * 7) % authors),
+            'author_flair_css_class': None,
+            'author_flair_text': None,
+            'body': '[deleted]' if deleted else make_body(rng, words, weights, mean_words),
+            'controversiality': int(rng.random() < 0.02),
+            'created_utc': str(int(now)),
+            'distinguished': None,
+            'edited': False,
+            'gilded': 0,
+            'id': comment_id,
+            'link_id': link_id,
+            'parent_id': parent_id,
+            'retrieved_on': int(now) + 86400 * 365,
+            'score': score,
+            'stickied': False,
+            'subreddit': subreddit,
+            'subreddit_id': 't5_' + base36(subreddit_names.index(subreddit) + 6),
+            'ups': score,
+        }
+
+def write_comments(path, n, compress=False, **options):
+    """Write n generated comments (see `generate`) to path, bz2-compressed if compress."""
+    opener = bz2.open if compress else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for comment in generate(n, **options):
+            f.write(json.dumps(comment, separators=(',', ':')) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic reddit comment dump.')
+    parser.add_argument('file', help='the file to write (e.g. RC_2006-01, or RC_2006-01.bz2 with --bz2)')
+    parser.add_argument('--month', type=parse_month, help='the month of the comments, as YYYY-MM (default: the one in the file name, or 2006-01)')
+    parser.add_argument('-n', '--comments', type=int, default=100000, help='the number of comments (default 100000)')
+    parser.add_argument('--bz2', action='store_true', help='compress with bz2')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--subreddits', type=int, default=50)
+    parser.add_argument('--open-posts', type=int, default=200, help='how many threads are active at the same time')
+    parser.add_argument('--comments-per-post', type=float, default=20, help='the average thread size')
+    parser.add_argument('--reply-prob', type=float, default=0.6, help='how many comments are replies to comments (rather than to the post)')
+    parser.add_argument('--recent', type=int, default=20, help='replies are to one of this many most recent comments of the thread (fewer gives deeper threads)')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='the number of different words')
+    parser.add_argument('--mean-words', type=float, default=15, help='the average comment length, in words')
+    parser.add_argument('--deleted-rate', type=float, default=0.05)
+    parser.add_argument('--comments-per-second', type=float, default=1.0, help='the average rate of new comments')
+    args = parser.parse_args()
+    month = args.month or file_month(args.file) or FIRST_MONTH
+    write_comments(args.file, args.comments, compress=args.bz2, seed=args.seed, month=month, subreddits=args.subreddits,
+                   open_posts=args.open_posts, comments_per_post=args.comments_per_post,
+                   reply_prob=args.reply_prob, recent=args.recent, vocabulary=args.vocabulary,
+                   mean_words=args.mean_words, deleted_rate=args.deleted_rate,
+                   comments_per_second=args.comments_per_second)
+
+if __name__ == '__main__':
+    main()
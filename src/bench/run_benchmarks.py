@@ -0,0 +1,222 @@
+"""
+Throughput benchmarks for the stages of the pipeline, on a generated comment
+dump (see gen_comments.py) or on given files:
+
+- decompress: reading the lines of the .bz2 file,
+- json: `json.loads` of every line,
+- preprocess: the `preprocess` chain of dump_pairs (filters and transformation),
+- tokenize: `tokenizer.Tokenizer` on every body,
+- paired_comments_set: the first pass of dump_pairs (reading and parsing included),
+- body_pairs: pairing up the (parsed and preprocessed) comments,
+- encoder: `Encoder.encode_batch` on the tokenized bodies.
+
+Each stage runs in its own (forked) process, so that its peak RSS can be
+measured on its own. The input of a stage is prepared in that process before
+the clock starts; the RSS it needs beyond that is reported as well. The
+results are printed, and can be written to a JSON file (--output), and
+compared with the results of an earlier run (--compare).
+
+    $ python3 bench/run_benchmarks.py [-n N] [--output results.json] [--compare old.json]
+"""
+import argparse
+import bz2
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gen_comments import write_comments
+from data_loader import Encoder
+from stream import Stream
+from tokenizer import Tokenizer
+from util import read_file
+import dump_pairs
+
+def _lines(files):
+    return [line for f in files['plain'] for line in read_file(f)]
+
+def _records(files):
+    return [json.loads(line) for line in _lines(files)]
+
+# Each stage is (setup, run): setup(files) prepares the input, and
+# run(input) does the work and returns the number of records processed.
+
+def _decompress(files):
+    return sum(1 for f in files['bz2'] for _ in read_file(f))
+
+def _json(lines):
+    loads = json.loads
+    for line in lines:
+        loads(line)
+    return len(lines)
+
+def _preprocess(records):
+    dump_pairs.preprocess(Stream(iter(records))).count()
+    return len(records)
+
+def _tokenize(bodies):
+    Tokenizer(lower=True).batch(bodies)
+    return len(bodies)
+
+def _count_records(files):
+    return (files, sum(1 for f in files['plain'] for _ in read_file(f)))
+
+def _paired_comments_set(files_and_count):
+    (files, count) = files_and_count
+    dump_pairs.paired_comments_set(*files['plain'])
+    return count
+
+def _preprocessed(files):
+    return dump_pairs.preprocess(Stream(iter(_records(files)))).map(dump_pairs.modify_parent_id).to_list()
+
+def _body_pairs(comments):
+    dump_pairs.body_pairs(Stream(iter(comments))).count()
+    return len(comments)
+
+def _encoder(sentences, batch_size=10000):
+    encoder = Encoder()
+    for i in range(0, len(sentences), batch_size):
+        encoder.encode_batch(sentences[i:i + batch_size])
+    return len(sentences)
+
+STAGES = {
+    'decompress': (lambda files: files, _decompress),
+    'json': (_lines, _json),
+    'preprocess': (_records, _preprocess),
+    'tokenize': (lambda files: [r['body'] for r in _records(files)], _tokenize),
+    'paired_comments_set': (_count_records, _paired_comments_set),
+    'body_pairs': (_preprocessed, _body_pairs),
+    'encoder': (lambda files: [r['body'].lower().split() for r in _records(files)], _encoder),
+}
+
+def _max_rss_mb():
+    # ru_maxrss is in kB on Linux (but in bytes on macOS).
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+def _proc_status_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+def _reset_peak_rss():
+    """
+    Start measuring the peak RSS from the current RSS, rather than from the
+    peak of the setup. Returns the current RSS, or None if that isn't
+    possible (it needs Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status_mb('VmRSS')
+    except (OSError, TypeError):
+        return None
+
+def _run_stage(name, files, conn):
+    (setup, run) = STAGES[name]
+    data = setup(files)
+    gc.collect()
+    reset = _reset_peak_rss()
+    rss_before = _max_rss_mb() if reset is None else reset
+    start = time.perf_counter()
+    records = run(data)
+    seconds = time.perf_counter() - start
+    peak = _max_rss_mb() if reset is None else _proc_status_mb('VmHWM')
+    conn.send({'records': records, 'seconds': seconds, 'peak_rss_mb': peak, 'stage_rss_mb': peak - rss_before})
+
+def run_stage(name, files, repeat=1):
+    """Run a stage in a new process (repeat times), and return the results of the fastest run."""
+    context = multiprocessing.get_context('fork')
+    best = None
+    for _ in range(repeat):
+        (receiver, sender) = context.Pipe(duplex=False)
+        process = context.Process(target=_run_stage, args=(name, files, sender))
+        process.start()
+        # Only the child has the sending end now, so if it dies, recv gets EOF.
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = None
+        finally:
+            receiver.close()
+        process.join()
+        if result is None or process.exitcode != 0:
+            raise RuntimeError('stage %s failed (exit code %s)' % (name, process.exitcode))
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    best['records_per_sec'] = best['records'] / best['seconds'] if best['seconds'] else None
+    return best
+
+def _git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, old):
+    print()
+    print(f'compared to {old.get("version")} ({old.get("time")}):')
+    for (name, result) in results['stages'].items():
+        before = old['stages'].get(name)
+        if before is None or not before.get('records_per_sec'):
+            continue
+        speed = result['records_per_sec'] / before['records_per_sec']
+        print(f'{name:20} {speed:6.2f}x records/s  '
+              f'{result["peak_rss_mb"] - before["peak_rss_mb"]:+9.1f} MB peak RSS')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the pipeline.')
+    parser.add_argument('files', nargs='*', help='plain comment files to use instead of generated ones (a .bz2 version of each is made for the decompress stage)')
+    parser.add_argument('-n', '--comments', type=int, default=100000, help='how many comments to generate (default 100000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=1, help='run each stage this many times, and keep the fastest')
+    parser.add_argument('--output', '-o', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file (from --output)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.files:
+            files = {'plain': args.files, 'bz2': []}
+            for (i, f) in enumerate(args.files):
+                path = os.path.join(tmp, 'RC_%d.bz2' % i)
+                with open(f, 'rb') as plain, bz2.open(path, 'wb') as compressed:
+                    shutil.copyfileobj(plain, compressed)
+                files['bz2'].append(path)
+        else:
+            files = {'plain': [os.path.join(tmp, 'RC_bench')], 'bz2': [os.path.join(tmp, 'RC_bench.bz2')]}
+            write_comments(files['plain'][0], args.comments, seed=args.seed)
+            write_comments(files['bz2'][0], args.comments, compress=True, seed=args.seed)
+        results = {
+            'version': _git_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'input': {'files': args.files, 'comments': None if args.files else args.comments, 'seed': args.seed,
+                      'bytes': sum(os.path.getsize(f) for f in files['plain'])},
+            'stages': {},
+        }
+        for name in args.stages:
+            result = run_stage(name, files, args.repeat)
+            results['stages'][name] = result
+            print(f'{name:20} {result["records_per_sec"]:12,.0f} records/s  {result["seconds"]:8.3f}s  '
+                  f'peak RSS {result["peak_rss_mb"]:8.1f} MB (stage {result["stage_rss_mb"]:+.1f} MB)')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import bz2
+import io
+import mmap
+import os
+import multiprocessing
+from workers import bounded_imap
+
+"""
+Parallel decompression of a single BZip2 file.
+
+A bz2 stream is a header (`BZh` + the block size level) followed by
+independently compressed blocks and an end-of-stream marker. Each block starts
+with the 48-bit magic number 0x314159265359 (BCD pi) and the end-of-stream
+marker is 0x177245385090 (BCD sqrt(pi)), followed by a 32-bit CRC. The catch
+is that blocks are not byte aligned, so the magic numbers can start at any
+bit offset.
+
+So: find all the markers (by searching for each of the 8 possible bit shifts
+of each marker), cut out the bits of each block, and turn every block into a
+tiny stand-alone bz2 stream (header + block + end-of-stream marker + CRC) that
+`bz2.decompress` can handle in a worker process. For a stream with a single
+block, the stream CRC is simply the block CRC, which is stored right after the
+block magic.
+
+The markers are only 48 bits, so they can (very rarely) also appear by chance
+inside the compressed data. A block that ends at such a false marker fails to
+decompress (the CRC won't match), so it is retried with the following block
+range appended.
+"""
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+
+SCAN_SIZE = 1 << 24     # bytes scanned for markers at a time
+MAX_MERGES = 4          # false markers in a row before giving up
+
+def _shifted_patterns(magic):
+    """
+    For each bit shift s (0-7), the 5 bytes that are completely determined by
+    the magic number when it starts s bits into a byte. (They are bytes 1-5 of
+    the 7 bytes that the shifted magic number touches.)
+    """
+    return [(s, (magic << (8 - s)).to_bytes(7, 'big')[1:6]) for s in range(8)]
+
+_PATTERNS = [(BLOCK_MAGIC, True, _shifted_patterns(BLOCK_MAGIC)),
+             (EOS_MAGIC, False, _shifted_patterns(EOS_MAGIC))]
+
+def _bits_at(data, bit_offset, nbits):
+    """Read nbits bits starting at bit_offset (zero-padded past the end)."""
+    first = bit_offset // 8
+    last = (bit_offset + nbits + 7) // 8
+    chunk = data[first:last]
+    value = int.from_bytes(chunk, 'big') << (8 * (last - first - len(chunk)))
+    return (value >> (last * 8 - bit_offset - nbits)) & ((1 << nbits) - 1)
+
+def find_markers(data):
+    """
+    Yield (bit_offset, is_block) for all block and end-of-stream markers in
+    data (bytes or mmap), in order.
+    """
+    size = len(data)
+    for lo in range(0, size, SCAN_SIZE):
+        hi = min(lo + SCAN_SIZE, size)
+        found = []
+        for (magic, is_block, patterns) in _PATTERNS:
+            for (shift, pattern) in patterns:
+                # Match positions i in [lo, hi), pattern may extend past hi.
+                i = data.find(pattern, lo, hi + len(pattern) - 1)
+                while i >= 0:
+                    bit_offset = (i - 1) * 8 + shift
+                    if bit_offset >= 0 and _bits_at(data, bit_offset, 48) == magic:
+                        found.append((bit_offset, is_block))
+                    i = data.find(pattern, i + 1, hi + len(pattern) - 1)
+        found.sort()
+        for marker in found:
+            yield marker
+
+def block_ranges(data):
+    """Yield (start, end) bit ranges of the compressed blocks in data."""
+    start = None
+    for (bit_offset, is_block) in find_markers(data):
+        if start is not None:
+            yield (start, bit_offset)
+        start = bit_offset if is_block else None
+
+def block_to_stream(data, start, end):
+    """
+    Turn the block in bits [start, end) of data into a complete bz2 stream.
+    `data` only has to contain the bytes from start // 8 onwards.
+    """
+    base = (start // 8) * 8
+    length = end - start
+    block = _bits_at(data, start - base, length)
+    crc = (block >> (length - 80)) & 0xffffffff
+    value = (block << 80) | (EOS_MAGIC << 32) | crc
+    pad = -(length + 80) % 8
+    return b'BZh9' + (value << pad).to_bytes((length + 80 + pad) // 8, 'big')
+
+def _decompress_block(task):
+    """
+    Worker function. Returns the task together with the decompressed data,
+    or None as data if the block range turned out not to be a valid block.
+    """
+    (filename, start, end) = task
+    with open(filename, 'rb') as f:
+        f.seek(start // 8)
+        data = f.read((end + 7) // 8 - start // 8)
+    try:
+        return (task, bz2.decompress(block_to_stream(data, start, end)))
+    except (OSError, EOFError, ValueError):
+        return (task, None)
+
+def _repair(filename, results):
+    """
+    Pass on decompressed blocks, merging block ranges that were split by a
+    false marker. A range that ends at a false marker fails, and so does the
+    range starting at it, so both are replaced by one merged range.
+    """
+    for ((_, start, end), data) in results:
+        merges = 0
+        while data is None:
+            merges += 1
+            if merges > MAX_MERGES:
+                raise OSError(f'{filename}: invalid bz2 block at bit {start}')
+            following = next(results, None)
+            if following is None:
+                raise OSError(f'{filename}: invalid bz2 block at bit {start}')
+            ((_, _, end), _) = following
+            (_, data) = _decompress_block((filename, start, end))
+        yield data
+
+def decompress_blocks(filename, workers=None, window=None):
+    """
+    Yield the decompressed contents of a bz2 file, one block at a time, in
+    order. The blocks are decompressed by a pool of `workers` processes
+    (default: one per CPU), with at most `window` blocks in flight.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            tasks = ((filename, start, end) for (start, end) in block_ranges(data))
+            with multiprocessing.Pool(workers) as pool:
+                results = bounded_imap(pool, _decompress_block, tasks, window)
+                for block in _repair(filename, results):
+                    yield block
+
+class _BlockReader(io.RawIOBase):
+    """A raw binary stream over an iterator of byte strings."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset >= len(self.buffer):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.buffer = chunk
+            self.offset = 0
+        n = min(len(b), len(self.buffer) - self.offset)
+        b[:n] = self.buffer[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.chunks.close()
+        super().close()
+
+def open_bz2_parallel(filename, workers=None):
+    """
+    Like `bz2.open(filename, 'rt')`, but the blocks are decompressed in
+    parallel. Lines that cross block boundaries (and characters, for that
+    matter) are put back together by the text layer, just as with `bz2.open`.
+    """
+    raw = _BlockReader(decompress_blocks(filename, workers))
+    return io.TextIOWrapper(io.BufferedReader(raw))
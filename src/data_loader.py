@@ -3,39 +3,233 @@
 import json
 import re
 import bz2
+import mmap
+from array import array
+from collections import Counter
+from itertools import accumulate
 from util import *
 from stream import Stream
+import record_cache
+from sketches import SpaceSaving, CountMinSketch, ValueSketch
 
-def read_records(*files):
+def read_records(*files, workers=1, ordered=True, cache_dir=None, fields=None,
+                 prefilter=None, limit=None, prefetch=None, byte_range=None):
     """
     Reads all the given files and returns a single stream containing
     all the records (as Python dictionaries) in those files.
     (Files can be bz2-compressed.)
     Converts from JSON but does no other preprocessing.
+    With workers > 1, multiple files are read in parallel, or the blocks of
+    a single bz2 file are. See `util.multi_file_streamer`.
+    If fields is given, the records only contain those fields.
+    With a cache_dir, the parsed records are cached there (see
+    `record_cache`), and the next run over the same files reads the cache
+    instead. Files are then read one at a time (but a single bz2 file is
+    still decompressed in parallel).
+    A prefilter is a predicate on the raw lines, used to skip lines before
+    they are parsed (see `raw_may_contain` and `raw_field_equals`). It must
+    never reject a line that should be kept, but it may let through lines
+    that later filters will reject. It is not used for files that are being
+    cached (the cache needs all the records).
+    Limit is the maximum number of lines/records read, whether or not they
+    pass the prefilter.
+    With prefetch, the files are read on a background thread, up to that many
+    batches of lines ahead (see `util.prefetch`).
+    A byte_range (start, end) reads only the lines starting in that range
+    of a single plain text file (see `util.split_file`), without caching.
     """
-    return Stream(multi_file_streamer(*files)).map(json.loads)
+    if byte_range is not None:
+        (filename,) = files
+        lines = Stream(read_byte_range(filename, *byte_range))
+    elif cache_dir is not None:
+        stream = Stream(concat(*(_cached_records(filename, cache_dir, fields, workers)
+                                 for filename in files)))
+        if prefetch:
+            stream = stream.prefetch(prefetch)
+        return stream if limit is None else stream.take(limit)
+    else:
+        lines = Stream(multi_file_streamer(*files, workers=workers, ordered=ordered))
+    if prefetch:
+        lines = lines.prefetch(prefetch)
+    if limit is not None:
+        lines = lines.take(limit)
+    if prefilter is not None:
+        lines = lines.filter(prefilter)
+    return _parse_records(lines, fields)
+
+def _parse_records(lines, fields):
+    if fields is None:
+        return Stream(lines).map(json.loads)
+    return Stream(lines).map(json_projection(fields))
+
+def json_projection(fields):
+    """
+    Return a function that parses a line of JSON (an object) into a dict with
+    only the given fields. Equivalent to
+    `lambda line: keep_fields(json.loads(line), set(fields))` (with the
+    fields in the same order, the one they have in the line), but only the
+    values of those fields are actually decoded.
+
+    It looks for `"field":` in the raw line and decodes the value right after
+    it. In valid JSON, quotes inside strings are escaped, so an unescaped
+    `"field":` has to be a key. But it could be the key of a nested object, so
+    lines with a '{' anywhere except at the start (rare in comments) are
+    parsed in full instead, as are lines where a field is not found in exactly
+    this form.
+    """
+    keys = [(field, '"' + field + '":', '"' + field + '"') for field in dict.fromkeys(fields)]
+    fields = set(fields)
+    decode = json.JSONDecoder().raw_decode
+    def parse(line):
+        if line.find('{', 1) >= 0:
+            return keep_fields(json.loads(line), fields)
+        found = []
+        for (field, key, quoted) in keys:
+            i = line.find(key)
+            if i > 0 and line[i - 1] != '\\':
+                j = i + len(key)
+                while line[j] in ' \t\r\n':
+                    j += 1
+                found.append((i, field, decode(line, j)[0]))
+            elif i >= 0 or quoted in line:
+                return keep_fields(json.loads(line), fields)
+        # In the order of the line (the positions are all different, so the
+        # values are never compared).
+        found.sort()
+        return {field: value for (_, field, value) in found}
+    return parse
+
+def _json_strings(values):
+    """The ways the strings in values can appear in JSON (plain and escaped)."""
+    quoted = set()
+    for value in values:
+        quoted.add(json.dumps(value))
+        quoted.add(json.dumps(value, ensure_ascii=False))
+    return quoted
+
+def raw_may_contain(*values):
+    """
+    A prefilter (see `read_records`) that only lets through lines containing
+    at least one of the given strings as a JSON string (in any field).
+    Good for keeping records where some field has one of a few values.
+    """
+    quoted = _json_strings(values)
+    return lambda line: any(q in line for q in quoted)
+
+def raw_field_equals(field, *values):
+    """
+    Return a predicate on raw JSON lines that is true only if the line
+    certainly has one of the given string values in the given field. (It can
+    be false even if the field does have one of those values, for example
+    with unusual formatting.) So `not raw_field_equals(...)` is a prefilter
+    for removing records with those values.
+    See `json_projection` for why an unescaped `"field":value` in a line
+    without nested objects has to be the field itself.
+    """
+    patterns = set()
+    for q in _json_strings(values):
+        patterns.add('"' + field + '":' + q)
+        patterns.add('"' + field + '": ' + q)
+    def p(line):
+        if line.find('{', 1) >= 0:
+            return False
+        for pattern in patterns:
+            i = line.find(pattern)
+            if i > 0 and line[i - 1] != '\\':
+                return True
+        return False
+    return p
+
+def _cached_records(filename, cache_dir, fields, workers):
+    path = record_cache.cache_path(cache_dir, filename)
+    if record_cache.is_valid(path, filename, fields):
+        records = record_cache.read_cache(path)
+        if fields is not None:
+            # The cache may have more fields than we asked for this time.
+            fields = set(fields)
+            records = map(lambda record: keep_fields(record, fields), records)
+    else:
+        records = _parse_records(read_file(filename, workers), fields)
+        records = record_cache.write_cache(path, filename, fields, records)
+    for record in records:
+        yield record
+
+VOCAB_MAGIC = b'VOCAB01\n'
 
 class Encoder():
-    """Expects to process sentences that have already been tokenized."""
+    """
+    Expects to process sentences that have already been tokenized.
+    Words get consecutive indices, in the order they are first seen.
+    Encoded sentences are `array('I')`s of indices, and the word counts are
+    kept in an `array('Q')`. The vocabulary (with the counts) can be saved
+    to a binary file, and loaded from it again quickly (see `load`).
+    """
 
     def __init__(self):
         self.w2i = {}
         self.i2w = []
-        self.i2count = []
+        self.i2count = array('Q')
+        self.mapped = None
+
+    def _add(self, word):
+        index = len(self.i2w)
+        self.i2w.append(word)
+        self.w2i[word] = index
+        self._counts().append(0)
+        return index
+
+    def _counts(self):
+        """The counts, copied from the file first if they are memory-mapped."""
+        if not isinstance(self.i2count, array):
+            self.i2count = array('Q', self.i2count)
+        return self.i2count
+
+    def _indices(self, words):
+        """The indices of the words (adding new ones), counting them."""
+        indices = list(map(self.w2i.get, words))
+        if None in indices:
+            w2i = self.w2i
+            for (i, index) in enumerate(indices):
+                if index is None:
+                    index = w2i.get(words[i])
+                    indices[i] = self._add(words[i]) if index is None else index
+        counts = self._counts()
+        for (index, n) in Counter(indices).items():
+            counts[index] += n
+        return indices
 
     def __call__(self, sentence):
-        """Encode a sentence. Returns the encoded sentence."""
-        encoded_word = []
-        for word in sentence:
-            if word not in self.w2i:
-                index = len(self.i2w)
-                self.i2w.append(word)
-                self.w2i[word] = index
-                self.i2count.append(0)
-            index = self.w2i[word]
-            self.i2count[index] += 1
-            encoded_word.append(index)
-        return sentence
+        """
+        Encode a sentence, adding any new words to the vocabulary and
+        counting them. Returns the indices, as an array('I').
+        """
+        return array('I', self._indices(list(sentence)))
+
+    def encode_batch(self, sentences):
+        """
+        Like calling the encoder on each of the sentences (and returning the
+        list of results), but all the words are looked up and counted in one
+        go, which is a lot faster.
+        """
+        sentences = [list(sentence) for sentence in sentences]
+        indices = self._indices([word for sentence in sentences for word in sentence])
+        encoded = []
+        start = 0
+        for sentence in sentences:
+            end = start + len(sentence)
+            encoded.append(array('I', indices[start:end]))
+            start = end
+        return encoded
+
+    def encode(self, sentence, unknown=None):
+        """
+        Encode a sentence without changing the vocabulary or the counts.
+        Unknown words get the index unknown, or are left out if it is None.
+        """
+        w2i = self.w2i
+        if unknown is None:
+            return array('I', [w2i[word] for word in sentence if word in w2i])
+        return array('I', [w2i.get(word, unknown) for word in sentence])
 
     def vocab(self):
         """The list of words."""
@@ -57,14 +251,174 @@ class Encoder():
         """Return the number of times this word occurred."""
         return self.count_index(self.index(word))
 
+    def total(self):
+        """The total number of words encoded."""
+        return sum(self.i2count)
+
+    def merge(self, other):
+        """
+        Add the words and counts of another encoder. New words get the next
+        indices, in the other encoder's order, so merging the encoders of
+        consecutive parts of the data gives the same result as encoding all
+        of it with one encoder.
+        """
+        w2i = self.w2i
+        counts = self._counts()
+        for (word, n) in zip(other.i2w, other.i2count):
+            index = w2i.get(word)
+            if index is None:
+                index = self._add(word)
+            counts[index] += n
+        return self
+
+    def save(self, path):
+        """
+        Save the vocabulary and the counts to a binary file: a header with
+        the number of words, the counts, the offsets of the words in the
+        text, and then all the words in one UTF-8 text.
+        """
+        offsets = array('Q', accumulate(map(len, self.i2w), initial=0))
+        with open(path, 'wb') as f:
+            f.write(VOCAB_MAGIC)
+            f.write(array('Q', [len(self.i2w)]).tobytes())
+            f.write(bytes(self.i2count))
+            f.write(offsets.tobytes())
+            f.write(''.join(self.i2w).encode('utf-8', 'surrogatepass'))
+
+    @staticmethod
+    def load(path):
+        """
+        Load an encoder saved with `save`. The file is memory-mapped: the
+        counts are used in place (until more sentences are encoded), and the
+        words are decoded in one go, so even a large vocabulary loads fast.
+        """
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(data)
+        start = len(VOCAB_MAGIC) + 8
+        if len(data) < start or data[:len(VOCAB_MAGIC)] != VOCAB_MAGIC:
+            raise ValueError(path + ': not a vocabulary file')
+        n = view[len(VOCAB_MAGIC):start].cast('Q')[0]
+        counts = view[start:start + 8*n].cast('Q')
+        start += 8*n
+        offsets = view[start:start + 8*(n + 1)].cast('Q')
+        text = str(view[start + 8*(n + 1):], 'utf-8', 'surrogatepass')
+        encoder = Encoder()
+        encoder.i2w = list(map(text.__getitem__, map(slice, offsets[:-1], offsets[1:])))
+        encoder.w2i = dict(zip(encoder.i2w, range(n)))
+        encoder.i2count = counts
+        encoder.mapped = data
+        return encoder
+
+
+class ApproxEncoder():
+    """
+    Like `Encoder` (for counting a vocabulary), but in a fixed amount of
+    memory, no matter how many different words there are: the most frequent
+    words are found with a `sketches.SpaceSaving` summary, and their counts
+    estimated with that and a `sketches.CountMinSketch`. The vocabulary is
+    then (an estimate of) the max_vocab most frequent words.
+    The words are counted per batch (of about batch_size different words)
+    first, since most of them are frequent ones.
+    Unlike `Encoder`, calling it doesn't return anything (the indices are
+    only known at the end).
+    """
+
+    def __init__(self, max_vocab, capacity=None, width=1 << 18, depth=4, batch_size=10000):
+        self.max_vocab = max_vocab
+        self.heavy_hitters = SpaceSaving(capacity or 4 * max_vocab)
+        self.sketch = CountMinSketch(width, depth)
+        self.batch_size = batch_size
+        self.pending = Counter()
+        self.i2w = None
+
+    def __call__(self, sentence):
+        """Count the words of a sentence."""
+        self.pending.update(sentence)
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def encode_batch(self, sentences):
+        for sentence in sentences:
+            self(sentence)
+
+    def _flush(self):
+        if self.pending:
+            self.heavy_hitters.update(self.pending)
+            self.sketch.update(self.pending)
+            self.pending = Counter()
+            self.i2w = None
+
+    def _vocab(self):
+        self._flush()
+        if self.i2w is None:
+            estimate = self.sketch.estimate
+            counts = [(word, min(n, estimate(word))) for (word, n) in self.heavy_hitters.top(2 * self.max_vocab)]
+            counts.sort(key=lambda wn: wn[1], reverse=True)
+            counts = counts[:self.max_vocab]
+            self.i2w = [word for (word, _) in counts]
+            self.w2i = {word: index for (index, word) in enumerate(self.i2w)}
+            self.i2count = [n for (_, n) in counts]
+        return self.i2w
+
+    def vocab(self):
+        """The list of (approximately) the max_vocab most frequent words."""
+        return self._vocab()
+
+    def word(self, index):
+        return self._vocab()[index]
+
+    def index(self, word):
+        self._vocab()
+        return self.w2i[word]
+
+    def count_index(self, word_index):
+        """The estimated number of times the word with this index occurred."""
+        self._vocab()
+        return self.i2count[word_index]
+
+    def count_word(self, word):
+        """The estimated number of times this word occurred (in the vocabulary or not)."""
+        self._vocab()
+        return self.sketch.estimate(word) if word not in self.w2i else self.count_index(self.w2i[word])
+
+    def total(self):
+        """The total number of words counted."""
+        self._flush()
+        return self.sketch.total
+
+    def merge(self, other):
+        """Add the counts of another ApproxEncoder (with the same sizes)."""
+        self._flush()
+        other._flush()
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.sketch.merge(other.sketch)
+        self.i2w = None
+        return self
+
+    def oov_rate(self):
+        """The (estimated) fraction of the words counted that are not in the vocabulary."""
+        self._vocab()
+        total = self.sketch.total
+        return 1 - sum(self.i2count) / total if total else 0.0
+
 
 class StatsAccumulator:
-    """A transparent filter."""
+    """
+    A transparent filter.
+    With track_values, the values of each field are counted too, exactly,
+    until a field has more than max_exact_values different values (if
+    given). From then on, that field's values are only counted in a
+    `sketches.ValueSketch` (in fixed memory): an estimate of the number of
+    distinct values, and (about) the top_values most frequent ones.
+    """
 
-    def __init__(self, track_values=False):
+    def __init__(self, track_values=False, max_exact_values=None, top_values=20):
         self.fields = {}   # id -> #count
         self.track_values = track_values
-        self.field_values = {}   # id -> (value -> #count)
+        self.field_values = {}   # id -> (value -> #count), or a ValueSketch
+        self.max_exact_values = max_exact_values
+        self.top_values = top_values
 
     def __call__(self, record):
         for (key, value) in record.items():
@@ -75,12 +429,42 @@ class StatsAccumulator:
             else:
                 self.fields[key] += 1
                 if self.track_values:
-                    if value not in self.field_values[key]:
-                        self.field_values[key][value] = 1
+                    values = self.field_values[key]
+                    if type(values) is not dict:
+                        values.add(value)
+                    elif value not in values:
+                        values[value] = 1
+                        if self.max_exact_values is not None and len(values) > self.max_exact_values:
+                            self._sketch(key)
                     else:
-                        self.field_values[key][value] += 1
+                        values[value] += 1
         return record
 
+    def _sketch(self, key):
+        """Switch to counting the values of the field in a ValueSketch."""
+        values = self.field_values[key]
+        if type(values) is dict:
+            self.field_values[key] = ValueSketch(self.top_values)
+            self.field_values[key].update(values)
+        return self.field_values[key]
+
+    def merge(self, other):
+        """Add the counts of another StatsAccumulator."""
+        for (key, n) in other.fields.items():
+            self.fields[key] = self.fields.get(key, 0) + n
+        for (key, values) in other.field_values.items():
+            counts = self.field_values.setdefault(key, {})
+            if type(counts) is dict and type(values) is dict:
+                for (value, n) in values.items():
+                    counts[value] = counts.get(value, 0) + n
+                if self.max_exact_values is not None and len(counts) > self.max_exact_values:
+                    self._sketch(key)
+            elif type(values) is dict:
+                counts.update(values)
+            else:
+                self._sketch(key).merge(values)
+        return self
+
     def show(self, show_count=False):
         items = sorted(self.fields.items(), key=lambda item: item[1])
         for (key, n) in items:
@@ -89,9 +473,17 @@ class StatsAccumulator:
             else:
                 print(key)
             if self.track_values:
+                values = self.field_values[key]
+                if type(values) is not dict:
+                    top = values.top(self.top_values)
+                    print('  (about ' + str(values.count_distinct()) + ' different values; '
+                          + ('the most common, with approximate counts:)' if top else 'none stand out)'))
+                    for (value, count) in top:
+                        print('  ' + str(value) + ': ' + str(count))
+                    continue
                 # TODO: sort by count
-                for value in self.field_values[key]:
-                    count = self.field_values[key][value]
+                for value in values:
+                    count = values[value]
                     print('  ' + str(value) + ': ' + str(count))
 
     def get_fields(self):
@@ -127,6 +519,49 @@ def strip_digits():
     regex = re.compile(r'\d+')
     return lambda s: re.sub(regex, ' ', s)
 
+def compile_normalizer(strip_specials=False, strip_digits=False, trim_whitespace=False,
+                       to_lower=False, tokenize=False):
+    """
+    The same as composing `keep_alnum()`, `strip_digits()`,
+    `trim_whitespace()`, `str.lower` and `str.split` (the ones asked for, in
+    that order), but in one pass over the text rather than one pass (and a
+    new string) for each of them.
+
+    When trimming or tokenizing, the result only depends on the words between
+    the characters that get replaced by spaces, so those are found directly:
+    for ASCII text (most of it) by one `str.translate` to spaces (and lower
+    case) and a split, otherwise with `findall`. Without either, every run of
+    special characters and every run of digits still becomes one space (so
+    '!1!' becomes three of them), which an alternation of the two does in
+    one `sub`. Outside ASCII, lowercasing comes last, as it can turn letters
+    into combining characters, which are not alphanumeric.
+    """
+    if tokenize or trim_whitespace:
+        if strip_specials or strip_digits:
+            word = re.compile(r'[^\W\d]' if strip_digits else r'\w') if strip_specials else re.compile(r'[^\s\d]')
+            findall = re.compile(word.pattern + '+').findall
+            table = {c: ' ' for c in range(128) if not word.match(chr(c))}
+            if to_lower:
+                table.update((c, chr(c).lower()) for c in range(ord('A'), ord('Z') + 1))
+            table = str.maketrans(table)
+            def words(s):
+                if s.isascii():
+                    return s.translate(table).split()
+                found = findall(s)
+                return [w.lower() for w in found] if to_lower else found
+        elif to_lower:
+            words = lambda s: s.lower().split()
+        else:
+            words = str.split
+        return words if tokenize else lambda s: ' '.join(words(s))
+    patterns = ([r'\W+'] if strip_specials else []) + ([r'\d+'] if strip_digits else [])
+    if not patterns:
+        return str.lower if to_lower else (lambda s: s)
+    sub = re.compile('|'.join(patterns)).sub
+    if to_lower:
+        return lambda s: sub(' ', s).lower()
+    return lambda s: sub(' ', s)
+
 # Note: mutates record!
 def strip_fields(record, fields):
     keys = set(record.keys())
@@ -145,9 +580,9 @@ def keep_fields(record, fields):
 
 def show_vocab(encoder, sort_by='index', reverse=False, brief=False):
     if brief:
-        words = sum(map(encoder.count_word, encoder.vocab()))
         print('vocab size: ' + str(len(encoder.vocab())))
-        print('total word count: ' + str(words))
+        print('total word count: ' + str(encoder.total()))
+        _show_oov_rate(encoder)
         return
     if sort_by == 'count':
         key_fun = lambda w: encoder.count_word(w)
@@ -157,3 +592,9 @@ def show_vocab(encoder, sort_by='index', reverse=False, brief=False):
         key_fun = lambda w: w
     vocab = sorted(encoder.vocab(), key = key_fun, reverse=reverse)
     print(', '.join([w + ' = ' + str(encoder.index(w)) + ' (' + str(encoder.count_word(w)) + ')' for w in vocab]))
+    _show_oov_rate(encoder)
+
+def _show_oov_rate(encoder):
+    # Only an approximate vocabulary (`ApproxEncoder`) leaves words out.
+    if hasattr(encoder, 'oov_rate'):
+        print('OOV rate: ' + format(encoder.oov_rate(), '.4%'))
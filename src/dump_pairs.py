@@ -1,4 +1,14 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
 from reddit_loader import *
+from stores import SpillingDict, EvictingDict
+from id_set import IdSet
+from partition import partition, map_shards
 from util import *
 from stream import Stream
 
@@ -6,6 +16,15 @@ from stream import Stream
 # Modify this section to define preprocessing.
 # ----------------------------------------------------------------------
 
+# Modify this function to skip comments before they are even parsed.
+def pre_parse_filter(line):
+    """
+    A cheap check on the raw JSON line of a comment. Return False only if the
+    comment should certainly be excluded (by `pre_transform_filter`, for
+    example); anything else is sorted out by the filters below anyway.
+    """
+    return raw_not_deleted(line)
+
 # Modify this function to decide which comments to keep.
 def pre_transform_filter(comment):
     """
@@ -33,25 +52,33 @@ def post_transform_filter(comment):
     """
     return True     # TODO: probably filter on body length?
 
+# The fields that the functions above (and the pairing) need. Only these are
+# read from the files; anything else is never even decoded. Add to this list
+# if the functions above use other fields (or set it to None to read all).
+record_fields = ['id', 'parent_id', 'body']
+
 # ======================================================================
 
 def modify_parent_id(comment):
     """
     Change the parent ID of the comment so it matches the comment ID of
-    the parent comment.
+    the parent comment. Replies to posts keep their 't3_' parent ID, which
+    can't be mistaken for the ID of a comment.
     """
-    parent_id = get_parent_comment_id(comment)
-    comment['parent_id'] = parent_id
+    if comment['parent_id'].startswith('t1_'):
+        comment['parent_id'] = get_parent_comment_id(comment)
     return comment
 
-def id_pairs(stream):
+def id_pairs(stream, compact=False):
     """
     The stream of comments should ideally have been processed such that
     comments that should be excluded (for whatever reason) have already been
     filtered out.
+    With compact, the IDs seen so far are kept in an `IdSet` rather than a set.
     """
     def gen():
-        parents = set() # Comment IDs seen so far - potential parents.
+        # Comment IDs seen so far - potential parents.
+        parents = IdSet() if compact else set()
         for comment in stream:
             comment_id = comment['id']
             parent_id = comment['parent_id']
@@ -60,29 +87,122 @@ def id_pairs(stream):
             parents.add(comment_id)
     return Stream(gen())
 
-def preprocess(stream):
+def _preprocess_comment(comment):
+    """
+    `preprocess` for a single comment: returns the transformed comment, or
+    None if it is filtered out.
+    """
+    if not pre_transform_filter(comment):
+        return None
+    comment = comment_transformation(comment)
+    return comment if post_transform_filter(comment) else None
+
+def preprocess(stream, workers=1):
+    """
+    With workers > 1, the preprocessing is done in parallel by that many
+    worker processes (keeping the order of the comments).
+    """
+    if workers > 1:
+        return (stream
+            .parallel_map(_preprocess_comment, workers=workers)
+            .filter(lambda comment: comment is not None)
+        )
     return (stream
         .filter(pre_transform_filter)
         .map(comment_transformation)
         .filter(post_transform_filter)
     )
 
-def paired_comments_set(*files):
+def paired_comments_set(*files, preprocess_workers=1, compact=False, **read_options):
     """
     Returns a set of all the comment IDs of comments that are paired with
-    another comment.
+    another comment. With compact, it is an `IdSet` (a lot smaller).
+    The read_options are passed on to `read_records`.
+    """
+    records = read_records(*files, fields=record_fields, prefilter=pre_parse_filter, **read_options)
+    stream = preprocess(records, preprocess_workers).map(modify_parent_id)
+    pairs = id_pairs(stream, compact)
+    if not compact:
+        return pairs.flat_map(set).to_set()
+    ids = IdSet()
+    for (comment_id, parent_id) in pairs:
+        ids.add(comment_id)
+        ids.add(parent_id)
+    return ids
+
+# The read options that can change which comments are paired.
+_PAIRING_OPTIONS = ('limit', 'byte_range', 'ordered')
+
+def _code_hash(code, h=None):
+    """A hash of what a code object does (but not where its file is)."""
+    h = hashlib.sha1() if h is None else h
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, type(code)):
+            _code_hash(const, h)
+        else:
+            h.update(repr(const).encode('utf-8'))
+    return h.hexdigest()
+
+def _pairs_header(files, options):
+    """
+    What a pairs file depends on (like `record_cache._header`): the files,
+    the fields and the read options, and the filtering and preprocessing
+    functions above (their code, so editing them makes old pairs files stale).
+    """
+    functions = (pre_parse_filter, pre_transform_filter, comment_transformation, post_transform_filter)
+    stats = [(os.path.abspath(f), os.stat(f)) for f in files]
+    header = {
+        'files': [[path, stat.st_size, stat.st_mtime_ns] for (path, stat) in stats],
+        'fields': record_fields,
+        'options': {key: options.get(key) for key in _PAIRING_OPTIONS if key in options},
+        'functions': {f.__name__: _code_hash(f.__code__) for f in functions},
+        'python': sys.version_info[:2],  # The bytecode (and so its hash) may change.
+    }
+    # As it reads back from JSON (with lists for tuples).
+    return json.loads(json.dumps(header))
+
+def _is_up_to_date(pairs_file, header):
+    try:
+        with open(pairs_file + '.json') as f:
+            return os.path.exists(pairs_file) and json.load(f) == header
+    except (OSError, ValueError):
+        return False
+
+def load_paired_comments_set(pairs_file, *files, **options):
+    """
+    Like paired_comments_set with compact=True, but the set is saved to
+    pairs_file, and just loaded from there (memory-mapped) if it was made
+    from the same files (same size and modification time) with the same
+    fields, read options and preprocessing. What it was made from is kept
+    next to it, in pairs_file + '.json'.
     """
-    stream = preprocess(read_records(*files)).map(modify_parent_id)
-    return id_pairs(stream).flat_map(set).to_set()
+    header = _pairs_header(files, options)
+    if _is_up_to_date(pairs_file, header):
+        return IdSet.load(pairs_file)
+    ids = paired_comments_set(*files, compact=True, **options)
+    if os.path.exists(pairs_file + '.json'):
+        os.remove(pairs_file + '.json')
+    ids.save(pairs_file)
+    with open(pairs_file + '.json', 'w') as f:
+        json.dump(header, f)
+    return ids
 
-def body_pairs(stream):
+def body_pairs(stream, store=None):
     """
     Returns a stream of (comment, reply) pairs, where the elements in
     the pairs are the comment bodies.
+    The bodies of all comments are kept in a dict, or in store, if given
+    (e.g. a `stores.SpillingDict`, or a `stores.EvictingDict` to forget old
+    comments).
     """
     def gen():
-        id_to_body = {}
+        id_to_body = {} if store is None else store
+        timed = isinstance(store, EvictingDict) and store.max_age is not None
         for comment in stream:
+            if timed:
+                store.advance(comment_time(comment))
             comment_id = comment['id']
             parent_id = comment['parent_id']
             id_to_body[comment_id] = comment['body']
@@ -90,22 +210,159 @@ def body_pairs(stream):
                 yield (id_to_body[parent_id], comment['body'])
     return Stream(gen())
 
-def get_pairs(*files):
-    pairs = paired_comments_set(*files)
-    stream = (read_records(*files)
+def context_samples(stream, k, store=None):
+    """
+    Returns a stream of (context, reply) samples for multi-turn dialogue,
+    where the context is a tuple of the bodies of (up to) k comments leading
+    up to the reply in its thread: its parent, the parent's parent, and so
+    on, oldest first. With k = 1, these are the pairs of `body_pairs`.
+    Each comment is stored once, as its body and a pointer to its parent,
+    and the contexts are rebuilt by following the pointers, so the memory
+    needed doesn't depend on k. The store is like for `body_pairs` (an
+    `EvictingDict` also counts the contexts cut short as lost).
+    """
+    def gen():
+        nodes = {} if store is None else store
+        timed = isinstance(store, EvictingDict) and store.max_age is not None
+        for comment in stream:
+            if timed:
+                store.advance(comment_time(comment))
+            parent_id = comment['parent_id']
+            nodes[comment['id']] = (comment['body'], parent_id)
+            context = []
+            while len(context) < k and parent_id in nodes:
+                (body, parent_id) = nodes[parent_id]
+                context.append(body)
+            if context:
+                context.reverse()
+                yield (tuple(context), comment['body'])
+    return Stream(gen())
+
+def _extractor(context):
+    """body_pairs, or context_samples with context turns."""
+    if context is None:
+        return body_pairs
+    return lambda stream, store: context_samples(stream, context, store)
+
+def _fields(store):
+    """The fields to read: record_fields, plus created_utc if store needs it."""
+    if record_fields is None or getattr(store, 'max_age', None) is None:
+        return record_fields
+    return record_fields + ['created_utc']
+
+def get_pairs(*files, preprocess_workers=1, compact=False, pairs_file=None, store=None, context=None,
+              **read_options):
+    """
+    With compact, the paired comment IDs are kept in an `IdSet`. With a
+    pairs_file, that set is also saved to (or loaded from) that file.
+    The store is passed on to `body_pairs`.
+    With context (a number of turns), the result is `context_samples`
+    instead. (Only paired comments can be in a context, so the first pass
+    works the same.)
+    """
+    if pairs_file is not None:
+        pairs = load_paired_comments_set(pairs_file, *files, preprocess_workers=preprocess_workers, **read_options)
+    else:
+        pairs = paired_comments_set(*files, preprocess_workers=preprocess_workers, compact=compact, **read_options)
+    stream = (read_records(*files, fields=_fields(store), prefilter=pre_parse_filter, **read_options)
         .filter(lambda comment: comment['id'] in pairs)
         .map(modify_parent_id)
     )
-    return body_pairs(preprocess(stream))
+    result = _extractor(context)(preprocess(stream, preprocess_workers), store)
+    if pairs_file is None:
+        return result
+    def gen():
+        # Unmap the pairs file once the second pass is done (or abandoned).
+        try:
+            for pair in result:
+                yield pair
+        finally:
+            pairs.close()
+    return Stream(gen())
+
+def get_pairs_single_pass(*files, preprocess_workers=1, memory_items=1000000, spill_dir=None, store=None,
+                          context=None, **read_options):
+    """
+    Like get_pairs, but reads the files only once. Instead of first finding
+    the paired comments, the bodies of all comments are stored, but only the
+    most recent memory_items of them are kept in memory. Older ones are moved
+    to a temporary database on disk (in spill_dir, if given).
+    If a store is given (an `EvictingDict`, say), it is used instead.
+    Context is like for `get_pairs`.
+    """
+    records = read_records(*files, fields=_fields(store), prefilter=pre_parse_filter, **read_options)
+    stream = preprocess(records, preprocess_workers).map(modify_parent_id)
+    extract = _extractor(context)
+    if store is not None:
+        return extract(stream, store)
+    def gen():
+        with SpillingDict(memory_items, spill_dir) as spilling:
+            for pair in extract(stream, spilling):
+                yield pair
+    return Stream(gen())
 
-def dump_pairs(*files):
-    for pair in get_pairs(*files):
+def dump_pairs(*files, **options):
+    for pair in get_pairs(*files, **options):
         print(f'{pair[0]}\t{pair[1]}')
 
-def dump_pairs_to_file(out_file, *in_files):
-    out = open(out_file, mode='w')
-    for pair in get_pairs(*in_files):
-        out.write(f'{pair[0]}\t{pair[1]}\n')
+def _dump_pairs_to_file(out_file, files, single_pass, max_age, max_parents, options):
+    """Returns the `EvictingDict` that was used, if any."""
+    store = None
+    if max_age is not None or max_parents is not None:
+        store = options['store'] = EvictingDict(max_parents, max_age)
+    pairs = get_pairs_single_pass(*files, **options) if single_pass else get_pairs(*files, **options)
+    with open(out_file, mode='w') as out:
+        if options.get('context') is None:
+            for pair in pairs:
+                out.write(f'{pair[0]}\t{pair[1]}\n')
+        else:
+            for (context, reply) in pairs:
+                out.write('\t'.join(context) + f'\t{reply}\n')
+    return store
+
+def dump_pairs_to_file(out_file, *in_files, single_pass=False, max_age=None, max_parents=None,
+                       shards=None, shard_dir=None, **options):
+    """
+    With max_age (in seconds) and/or max_parents, comments are forgotten once
+    they are that old, or once there are that many newer ones. Replies to
+    them are lost, and how many is reported on stderr.
+    With shards, the comments are first partitioned by thread into that many
+    temporary shard files (in shard_dir, if given; see `partition`), and the
+    shards are then processed in parallel, by `workers` processes. The pairs
+    are the same, but grouped by shard.
+    With context (see `get_pairs`), each line has the context turns and then
+    the reply, so it has up to context + 1 columns.
+    """
+    if shards is None:
+        store = _dump_pairs_to_file(out_file, in_files, single_pass, max_age, max_parents, options)
+        counts = None if store is None else (store.lost, store.evicted_count)
+    else:
+        counts = _dump_shard_pairs_to_file(out_file, in_files, shards, shard_dir, single_pass,
+                                           max_age, max_parents, options)
+    if counts is not None:
+        print(f'Replies lost to eviction: {counts[0]} (evicted comments: {counts[1]})', file=sys.stderr)
+
+def _dump_shard_pairs_to_file(out_file, in_files, shards, shard_dir, single_pass, max_age, max_parents, options):
+    workers = options.pop('workers', 1)
+    # The shards are read once each, in worker processes (that can't have
+    # workers of their own).
+    for option in ('preprocess_workers', 'cache_dir', 'prefetch'):
+        options.pop(option, None)
+    def dump_shard(path):
+        store = _dump_pairs_to_file(path + '.pairs', [path], single_pass, max_age, max_parents, dict(options))
+        return (path + '.pairs', None if store is None else (store.lost, store.evicted_count))
+    counts = None
+    with tempfile.TemporaryDirectory(dir=shard_dir) as directory:
+        paths = partition(*in_files, shards=shards, directory=directory, workers=workers,
+                          prefilter=pre_parse_filter)
+        with open(out_file, mode='w') as out:
+            for (pairs_file, shard_counts) in map_shards(dump_shard, paths, workers):
+                with open(pairs_file) as pairs:
+                    shutil.copyfileobj(pairs, out)
+                os.remove(pairs_file)
+                if shard_counts is not None:
+                    counts = tuple(map(sum, zip(counts or (0, 0), shard_counts)))
+    return counts
 
 # ======================================================================
 # Run as a standalone program to dump comment pairs to a file.
@@ -119,4 +376,34 @@ data_files = [
 pairs_output_file = 'pairs.txt'
 
 if __name__ == '__main__':
-    dump_pairs_to_file(pairs_output_file, *data_files)
+    parser = argparse.ArgumentParser(description='Dump comment-reply pairs (tab separated) to a file.')
+    parser.add_argument('file', nargs='*', default=data_files, help='the files to read (plain or .bz2). Defaults to `data_files`.')
+    parser.add_argument('--output', '-o', default=pairs_output_file, help='the file to write the pairs to')
+    parser.add_argument('--workers', type=int, default=1, help='read up to this many files in parallel, or the blocks of a single .bz2 file')
+    parser.add_argument('--cache-dir', help='cache the parsed records in this directory (the second pass then reads the cache)')
+    parser.add_argument('--preprocess-workers', type=int, default=1, help='do the preprocessing in this many worker processes')
+    parser.add_argument('--prefetch', type=int, help='read the files on a background thread, up to this many batches of lines ahead')
+    parser.add_argument('--compact-ids', action='store_true', help='keep the IDs of paired comments in a compact set (a few bits per ID instead of about 100 bytes)')
+    parser.add_argument('--pairs-file', help='save the IDs of paired comments to this file, and load them from there next time (if it was made from the same input files and preprocessing)')
+    parser.add_argument('--context', type=int, metavar='K', help='write up to K preceding comments in the thread (oldest first) before each reply, instead of just the parent')
+    evict = parser.add_argument_group(title='Eviction', description='Forget old comments (and lose replies to them) to bound the memory use.')
+    evict.add_argument('--max-age', type=float, help='forget comments this many seconds older than the newest one (e.g. 604800 for a week)')
+    evict.add_argument('--max-parents', type=int, help='remember at most this many comments')
+    shard = parser.add_argument_group(title='Sharding', description='Split the comments by thread into shards first, and process the shards in parallel (with --workers processes).')
+    shard.add_argument('--shards', type=int, help='the number of shards (the memory needed depends on the largest shard). The pairs are grouped by shard.')
+    shard.add_argument('--shard-dir', help='where to put the temporary shard files')
+    single = parser.add_argument_group(title='Single pass', description='Read the files only once, keeping older comments on disk.')
+    single.add_argument('--single-pass', action='store_true', help='read the files once instead of twice')
+    single.add_argument('--memory-items', type=int, default=1000000, help='the number of comment bodies kept in memory')
+    single.add_argument('--spill-dir', help='where to put the temporary database for older comments')
+    args = parser.parse_args()
+    if args.shards is not None and args.pairs_file is not None:
+        parser.error('--pairs-file cannot be used with --shards')
+    if args.single_pass:
+        options = {'single_pass': True, 'memory_items': args.memory_items, 'spill_dir': args.spill_dir}
+    else:
+        options = {'compact': args.compact_ids, 'pairs_file': args.pairs_file}
+    dump_pairs_to_file(args.output, *args.file, workers=args.workers, cache_dir=args.cache_dir,
+                       preprocess_workers=args.preprocess_workers, prefetch=args.prefetch,
+                       max_age=args.max_age, max_parents=args.max_parents,
+                       shards=args.shards, shard_dir=args.shard_dir, context=args.context, **options)
@@ -0,0 +1,155 @@
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left
+
+"""
+Compact sets of reddit IDs.
+
+Reddit IDs (like 'c02s9rv') are base 36 numbers, so they can be stored as
+integers instead of strings. A Python str in a set costs around 100 bytes,
+an integer in one of the containers below costs at most 2 bytes.
+
+The integers are split into their high bits and their low 16 bits, and the
+low bits of all IDs with the same high bits go in one container (like
+"roaring bitmaps"):
+- a sorted array of 16-bit integers while there are only a few of them, or
+- a bitmap of 2^16 bits (8 kB) when there are more than 4096 of them.
+Comment IDs are assigned in order, so within a month of data they are dense
+and most containers end up as bitmaps: about one bit per possible ID.
+
+An IdSet can be saved to a file and loaded again with mmap, which is almost
+instant since nothing has to be parsed or copied.
+"""
+
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 1 << 13
+MAGIC = b'IDSET1\n\0'
+
+_ID = re.compile('[0-9a-z]+')
+
+def is_id(s):
+    """True if s is a reddit ID (without a prefix like 't1_')."""
+    return isinstance(s, str) and _ID.fullmatch(s) is not None
+
+def base36(comment_id):
+    """
+    The integer value of a reddit ID. Raises ValueError for anything else
+    (`int` would also take 't3_abc', ' c1 ' or '-c1').
+    """
+    if _ID.fullmatch(comment_id) is None:
+        raise ValueError('not a reddit ID: %r' % (comment_id,))
+    return int(comment_id, 36)
+
+def _to_bitmap(values):
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in values:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return bitmap
+
+def _is_bitmap(container):
+    # Arrays are converted to bitmaps long before they get this long.
+    return len(container) == BITMAP_BYTES
+
+class IdSet:
+    """A set of reddit IDs (base 36 strings), stored compactly."""
+
+    def __init__(self, ids=()):
+        self.containers = {}    # high bits -> array('H') or bitmap
+        self.mapped = None
+        for comment_id in ids:
+            self.add(comment_id)
+
+    def add(self, comment_id):
+        n = base36(comment_id)
+        (high, low) = (n >> 16, n & 0xffff)
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array('H', [low])
+        elif isinstance(container, array):
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                container.insert(i, low)
+                if len(container) > ARRAY_LIMIT:
+                    self.containers[high] = _to_bitmap(container)
+        else:
+            container[low >> 3] |= 1 << (low & 7)
+
+    def __contains__(self, comment_id):
+        try:
+            n = base36(comment_id)
+        except (TypeError, ValueError):
+            return False
+        container = self.containers.get(n >> 16)
+        if container is None:
+            return False
+        low = n & 0xffff
+        if _is_bitmap(container):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self):
+        n = 0
+        for container in self.containers.values():
+            if _is_bitmap(container):
+                n += sum(bin(byte).count('1') for byte in bytes(container))
+            else:
+                n += len(container)
+        return n
+
+    def save(self, path):
+        """Save to a file that `IdSet.load` can memory-map."""
+        index = array('q')
+        offset = 0
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            is_array = not _is_bitmap(container)
+            size = len(container) * (2 if is_array else 1)
+            index.extend([high, int(is_array), offset, size])
+            offset += size
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(array('q', [len(self.containers)]).tobytes())
+            f.write(index.tobytes())
+            for high in sorted(self.containers):
+                f.write(bytes(self.containers[high]))
+
+    @staticmethod
+    def load(path):
+        """
+        Memory-map a set saved with `save`. The result is read-only (and
+        keeps the file mapped until `close`).
+        """
+        ids = IdSet()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < len(MAGIC) + 8:
+                raise ValueError(path + ': not an IdSet file')
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(MAGIC)] != MAGIC:
+            data.close()
+            raise ValueError(path + ': not an IdSet file')
+        view = memoryview(data)
+        start = len(MAGIC) + 8
+        n = view[len(MAGIC):start].cast('q')[0]
+        index = view[start:start + 32 * n].cast('q')
+        start += 32 * n
+        for i in range(0, 4 * n, 4):
+            (high, is_array, offset, size) = index[i:i + 4].tolist()
+            container = view[start + offset:start + offset + size]
+            ids.containers[high] = container.cast('H') if is_array else container
+        index.release()
+        ids.mapped = (data, view)
+        return ids
+
+    def close(self):
+        """Close the file of a set from `load` (which can't be used after that)."""
+        if self.mapped is not None:
+            (data, view) = self.mapped
+            for container in self.containers.values():
+                container.release()
+            self.containers = {}
+            view.release()
+            data.close()
+            self.mapped = None
@@ -0,0 +1,69 @@
+import gzip
+import os
+import zlib
+from itertools import islice
+from data_loader import json_projection
+from util import multi_file_streamer
+from workers import parallel_map
+
+"""
+Partitioning comments by thread.
+
+Whole threads (for conversations, or pairs) are spread across a whole month
+of comments, so working on threads normally means keeping the whole month in
+memory. Instead, `partition` hashes each record's link_id (the post it is in)
+into one of N shard files, so every thread ends up entirely in one shard.
+Each shard can then be processed on its own, in parallel (`map_shards`), and
+the memory needed depends on the largest shard rather than on all the data.
+
+The shards are gzip files with compression level 1, which is fast enough to
+keep up with the partitioning, but still cuts the disk space to about a
+quarter. (`util.read_file` can read them back.)
+"""
+
+def shard_of(key, shards):
+    """
+    The shard (in range(shards)) for a key. Unlike the built-in hash, this is
+    the same in every process.
+    """
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+def shard_paths(directory, shards):
+    return [os.path.join(directory, 'shard-%04d.gz' % i) for i in range(shards)]
+
+def partition(*files, shards, directory, key='link_id', workers=1, prefilter=None,
+              limit=None, compresslevel=1):
+    """
+    Splits the records in the files into the given number of shard files in
+    directory, such that all records with the same value for key end up in
+    the same shard (in their original order). Records without the key all go
+    in the same shard. Returns the paths of the shard files.
+    The lines are copied as they are, without parsing more than the key.
+    Workers, prefilter and limit are like for `data_loader.read_records`.
+    """
+    get_key = json_projection([key])
+    paths = shard_paths(directory, shards)
+    outs = [gzip.open(path, 'wt', compresslevel=compresslevel) for path in paths]
+    try:
+        lines = multi_file_streamer(*files, workers=workers)
+        if limit is not None:
+            lines = islice(lines, limit)
+        for line in lines:
+            if prefilter is not None and not prefilter(line):
+                continue
+            if not line.endswith('\n'):
+                line += '\n'
+            outs[shard_of(get_key(line).get(key), shards)].write(line)
+    finally:
+        for out in outs:
+            out.close()
+    return paths
+
+def map_shards(f, paths, workers=None, ordered=True):
+    """
+    Applies f to each shard (path) in a pool of worker processes, and returns
+    an iterator over the results (see `workers.parallel_map`). Since the
+    workers can't start pools of their own, f should do everything in its
+    own process.
+    """
+    return parallel_map(f, paths, workers, chunksize=1, ordered=ordered)
@@ -0,0 +1,98 @@
+import hashlib
+import marshal
+import os
+import struct
+import sys
+
+"""
+A cache of already parsed records, so that repeated runs over the same input
+files don't have to decompress and parse the JSON again.
+
+The cache for a file is a single binary file: a header describing the source
+file (path, size and modification time) and which fields were stored, followed
+by the records, each one `marshal`ed and prefixed by its length. `marshal` is
+much faster to load than JSON, and since only the fields that are actually
+used need to be stored, the cache can be a lot smaller than the original.
+
+If the source file has changed, or the cache doesn't have all the fields that
+are asked for, the cache is stale and gets rebuilt on the next read.
+"""
+
+MAGIC = b'RCACHE1\n'
+_LENGTH = struct.Struct('<I')
+
+def cache_path(cache_dir, filename):
+    """Where the cache for filename goes. The name includes a hash of the full path."""
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, os.path.basename(filename) + '.' + key + '.cache')
+
+def _header(filename, fields):
+    stat = os.stat(filename)
+    return {
+        'source': os.path.abspath(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'fields': None if fields is None else sorted(fields),
+        'python': sys.version_info[:2],  # The marshal format may change.
+    }
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        return None
+    (n,) = _LENGTH.unpack(f.read(_LENGTH.size))
+    return marshal.loads(f.read(n))
+
+def is_valid(path, filename, fields=None):
+    """
+    True if there is a cache at path that is up to date with filename and
+    contains (at least) the given fields (all fields if fields is None).
+    """
+    try:
+        with open(path, 'rb') as f:
+            cached = _read_header(f)
+    except (OSError, EOFError, ValueError, struct.error):
+        return False
+    if cached is None:
+        return False
+    current = _header(filename, fields)
+    for key in ('source', 'size', 'mtime', 'python'):
+        if cached[key] != current[key]:
+            return False
+    if cached['fields'] is None:
+        return True
+    return fields is not None and set(fields) <= set(cached['fields'])
+
+def read_cache(path):
+    """Yield the records stored in the cache at path."""
+    with open(path, 'rb') as f:
+        _read_header(f)
+        read = f.read
+        while True:
+            prefix = read(_LENGTH.size)
+            if not prefix:
+                return
+            (n,) = _LENGTH.unpack(prefix)
+            yield marshal.loads(read(n))
+
+def write_cache(path, filename, fields, records):
+    """
+    Pass on records (which should be the records of filename, with only the
+    given fields) and store them in a cache at path on the way.
+    The cache is only put in place once all records have been written, so a
+    run that stops early (e.g. because of --read-max) leaves no cache behind.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp' + str(os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            header = marshal.dumps(_header(filename, fields))
+            f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+            for record in records:
+                data = marshal.dumps(record)
+                f.write(_LENGTH.pack(len(data)))
+                f.write(data)
+                yield record
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -1,7 +1,15 @@
 import argparse
+import contextlib
+from collections import OrderedDict
+import io
+import sys
+import tempfile
 from data_loader import *
 from util import *
 from stream import Stream
+from stores import EvictingDict
+from partition import partition, map_shards
+from tokenizer import Tokenizer
 
 """
 - The data set contains only comments (not the posts that they are commenting on).
@@ -46,6 +54,22 @@ class RedditStatsAccumulator:
                 print(' ! inconsistent mapping')
         return comment
 
+    def merge(self, other):
+        """Add the counts of another RedditStatsAccumulator."""
+        for (subreddit_id, n) in other.subreddit_posts.items():
+            if subreddit_id not in self.subreddit_posts:
+                self.subreddit_posts[subreddit_id] = n
+                self.subreddit_names[subreddit_id] = other.subreddit_names[subreddit_id]
+            else:
+                self.subreddit_posts[subreddit_id] += n
+                if self.subreddit_names[subreddit_id] != other.subreddit_names[subreddit_id]:
+                    print(' ! inconsistent mapping')
+        self.posts += other.posts
+        self.pairs += other.pairs
+        self.comments += other.comments
+        self.deleted += other.deleted
+        return self
+
     # TODO: deprecated
     def get_stats(self):
         return {'subreddit_posts': self.subreddit_posts,
@@ -79,6 +103,15 @@ def in_subreddit(*subreddits):
 def not_deleted(comment):
     return comment['body'] != '[deleted]'
 
+_raw_deleted = raw_field_equals('body', '[deleted]')
+
+def raw_not_deleted(line):
+    """
+    Like not_deleted, but on a raw JSON line (for `read_records`' prefilter).
+    Only rejects lines that are certainly deleted comments.
+    """
+    return not _raw_deleted(line)
+
 def on_comment(comment):
     """
     Note that filtering on this makes sense in some situations but not
@@ -143,18 +176,25 @@ def get_comment_pairs_ids(stream):
             yield (comment.id, pid)
     return Stream(f())
 
-def get_comment_pairs(stream):
+def comment_time(comment):
+    return float(comment['created_utc'])
+
+def get_comment_pairs(stream, parents=None):
     """
     Like get_comment_pairs_ids but returns pairs of actual comments (dicts)
-    rather than IDs. (Needs to buffer all comments it has ever seen.)
+    rather than IDs. (Needs to buffer all comments it has ever seen, unless
+    parents is a `stores.EvictingDict`, which forgets old comments.)
     """
     def f():
-        parents = {}
+        buffer = {} if parents is None else parents
+        timed = isinstance(buffer, EvictingDict) and buffer.max_age is not None
         for comment in stream.filter(on_comment):
-            parents[comment['id']] = comment
+            if timed:
+                buffer.advance(comment_time(comment))
+            buffer[comment['id']] = comment
             pid = get_parent_comment_id(comment)
-            if pid in parents:
-                yield (comment, parents[pid])
+            if pid in buffer:
+                yield (comment, buffer[pid])
     return Stream(f())
 
 def get_replies(comments, comment):
@@ -166,55 +206,158 @@ def get_replies(comments, comment):
             replies.append(other)
     return replies
 
-def show_comment_recursively(comments, comment, level=0, show_header=True, clean=True):
+def show_comment(comment, level=0, show_header=True, clean=True):
     """
-    Recreates the comment threads. Comments are assumed to be raw.
-    (They could be preprocessed, but then they must at least still have their
-    'author' fields.)
+    Shows one comment of a thread, indented by level. Comments are assumed
+    to be raw. (They could be preprocessed, but then they must at least
+    still have their 'author' fields.)
     Only shows comment ID, author, and comment body.
     When clean is true, do some minimal cleanup (remove excess whitespace).
     """
-    regex = re.compile(r'\s+')
     indentation = '    '*level
     body = comment['body']
-    cid = comment['id']
-    author = comment['author'] if show_header else ''
-    comments.remove(comment)    # Done. We don't want to print this agin.
     header = indentation + '- '
     if show_header:
-        header += cid + ', ' + author + ':\n  ' + indentation
+        header += comment['id'] + ', ' + comment['author'] + ':\n  ' + indentation
     if clean:
-        body = re.sub(regex, ' ', body.strip())
-    # Print this message.
+        body = _whitespace.sub(' ', body.strip())
     print(header + str(body))
-    # Then recursively show replies.
-    for reply in get_replies(comments, comment):
-        show_comment_recursively(comments, reply, level+1, show_header, clean)
 
-# Note: Consumes the stream!
-def show_conversations(comments, limit=20, show_header=True, clean=True):
-    """Recreates the comment threads."""
+_whitespace = re.compile(r'\s+')
+
+def _walk_thread(root, replies, seen):
+    """
+    The comments in the thread below root, as (level, comment) pairs, depth
+    first (replies in order). Iterative, so there is no limit on the depth.
+    Comments in seen are skipped, and the others are added to it.
+    """
+    thread = []
+    stack = [(0, root)]
+    while stack:
+        (level, comment) = stack.pop()
+        cid = comment['id']
+        if cid in seen:
+            continue
+        seen.add(cid)
+        thread.append((level, comment))
+        children = replies.get(cid, ())
+        stack.extend((level + 1, child) for child in reversed(children))
+    return thread
+
+def comment_threads(comments, max_age=None):
+    """
+    Reconstructs the comment threads, in O(n) time. Yields each thread as a
+    list of (level, comment) pairs, starting with its root (level 0): a
+    comment on a post, or on a comment that isn't in the data. Replies
+    follow their parents, depth first, in their original order.
+
+    Without max_age, all the comments are read first, and the threads come
+    out in the order of their roots.
+    With max_age (seconds), comments must have a created_utc, and a thread
+    counts as complete once it hasn't had a new comment for that long. It is
+    then yielded right away, and forgotten, so only the open threads are in
+    memory. Threads come out in the order they are completed, and a late
+    reply to a completed thread starts a new one.
+    """
+    if max_age is None:
+        return _all_threads(comments)
+    return _threads_by_age(comments, max_age)
+
+def _all_threads(comments):
     comments = list(comments)
-    count = 0
-    # Can't iterate in a cleaner way because show_comment modifies the list.
-    while (limit <= 0 or count <= limit) and len(comments) > 0:
-        show_comment_recursively(comments, comments[0], show_header=show_header, clean=clean)
-        count += 1
+    replies = {}
+    for comment in comments:
+        replies.setdefault(get_parent_comment_id(comment), []).append(comment)
+    seen = set()
+    for comment in comments:
+        if comment['id'] not in seen:
+            yield _walk_thread(comment, replies, seen)
+
+def _threads_by_age(comments, max_age):
+    # root id -> [root, replies, time of the last comment], least recently
+    # active first.
+    threads = OrderedDict()
+    thread_of = {}  # comment id -> root id (for the open threads)
+    def close_oldest():
+        (_, (root, replies, _)) = threads.popitem(last=False)
+        thread = _walk_thread(root, replies, set())
+        for (_, comment) in thread:
+            del thread_of[comment['id']]
+        return thread
+    for comment in comments:
+        now = comment_time(comment)
+        while threads and threads[next(iter(threads))][2] < now - max_age:
+            yield close_oldest()
+        pid = get_parent_comment_id(comment)
+        root_id = thread_of.get(pid)
+        if root_id is None:
+            root_id = comment['id']
+            threads[root_id] = [comment, {}, now]
+        else:
+            thread = threads[root_id]
+            thread[1].setdefault(pid, []).append(comment)
+            thread[2] = max(thread[2], now)
+            threads.move_to_end(root_id)
+        thread_of[comment['id']] = root_id
+    while threads:
+        yield close_oldest()
 
-def _preprocessor_pipeline(args):
-    funcs = []
-    key = args.text_field
-    if args.strip_specials:
-        funcs.append(wrap(keep_alnum(), key))
-    if args.strip_digits:
-        funcs.append(wrap(strip_digits(), key))
-    if args.trim_whitespace:
-        funcs.append(wrap(trim_whitespace(), key))
-    if args.to_lower:
-        funcs.append(wrap(str.lower, key))
-    if args.tokenize:
-        funcs.append(wrap(str.split, key))
-    return preprocessor_pipeline(funcs)
+# Note: Consumes the stream!
+def show_conversations(comments, limit=20, show_header=True, clean=True, max_age=None):
+    """
+    Recreates the comment threads (at most limit of them, unless limit <= 0).
+    See `comment_threads` for max_age.
+    """
+    for (count, thread) in enumerate(comment_threads(comments, max_age)):
+        if limit > 0 and count >= limit:
+            break
+        for (level, comment) in thread:
+            show_comment(comment, level, show_header, clean)
+
+def _preprocessor_pipeline(args, batches=False):
+    """
+    The text preprocessing from the arguments, as a function on comments, or
+    on lists of comments if batches is true. All the steps are done in a
+    single pass over the text (see `compile_normalizer`).
+    """
+    if args.tokenize and args.tokenizer == 'reddit':
+        return _reddit_tokenizer_pipeline(args, batches)
+    options = (args.strip_specials, args.strip_digits, args.trim_whitespace, args.to_lower, args.tokenize)
+    if not any(options):
+        return preprocessor_pipeline([])
+    wrapper = wrap_batch if batches else wrap
+    return wrapper(compile_normalizer(*options), args.text_field)
+
+def _reddit_tokenizer_pipeline(args, batches):
+    """
+    Like `_preprocessor_pipeline`, with `tokenizer.Tokenizer` for the
+    tokenizing (and lowercasing, which leaves emoticons alone). Trimming
+    whitespace makes no difference then.
+    """
+    tokenize = Tokenizer(lower=args.to_lower)
+    field = args.text_field
+    if args.strip_specials or args.strip_digits:
+        normalize = compile_normalizer(args.strip_specials, args.strip_digits)
+    else:
+        normalize = None
+    if not batches:
+        return wrap(tokenize if normalize is None else compose(normalize, tokenize), field)
+    def tokenize_batch(comments):
+        texts = [comment[field] for comment in comments]
+        if normalize is not None:
+            texts = list(map(normalize, texts))
+        for (comment, tokens) in zip(comments, tokenize.batch(texts)):
+            comment[field] = tokens
+        return comments
+    return tokenize_batch
+
+def _length_filters(args):
+    filters = []
+    if args.max_length:
+        filters.append(max_text_length(args.max_length))
+    if args.min_length:
+        filters.append(min_text_length(args.min_length))
+    return filters
 
 def _subreddit_filter(args):
     if args.keep_subreddits is not None:
@@ -226,6 +369,42 @@ def _subreddit_filter(args):
     else:
         return lambda comment: True
 
+def _raw_line_filter(args):
+    """
+    A cheap check on the raw lines, compiled from the filters in the
+    arguments, so that most lines that would be filtered out anyway don't
+    even have to be parsed. The actual filters still run afterwards.
+    (The subreddit filter comes after --process-max in `_main`, so it can't be
+    moved in front of that.)
+    """
+    funcs = []
+    if args.ignore_deleted:
+        funcs.append(raw_not_deleted)
+    if args.process_max is None:
+        if args.keep_subreddits is not None:
+            funcs.append(raw_may_contain(*args.keep_subreddits))
+        elif args.strip_subreddits is not None:
+            stripped = raw_field_equals('subreddit', *args.strip_subreddits)
+            funcs.append(lambda line: not stripped(line))
+    if not funcs:
+        return None
+    return lambda line: all(f(line) for f in funcs)
+
+def _read_fields(args):
+    """
+    The fields that need to be read from the files at all: the ones in
+    --keep-fields, plus the ones needed by the filters that come before the
+    field filter in `_main`. None means all fields.
+    """
+    if args.keep_fields is None:
+        return None
+    fields = set(args.keep_fields)
+    if args.ignore_deleted:
+        fields.add('body')
+    if args.keep_subreddits is not None or args.strip_subreddits is not None:
+        fields.add('subreddit')
+    return fields
+
 def _field_filter(args):
     if args.keep_fields is not None:
         fields = set(args.keep_fields)
@@ -246,58 +425,171 @@ def _show_pairs(keep_parent=False):
         _show_pair(comment, keep_parent)
     return f
 
-def _show_conversations(stream, show_header):
-    show_conversations(stream, limit=-1, show_header=args.show_header, clean=False)
+def _show_conversations(stream, show_header, max_age=None):
+    show_conversations(stream, limit=-1, show_header=show_header, clean=False, max_age=max_age)
+
+def _encode(stream, encoder, args):
+    """Feeds the (tokenized) texts to the encoder, leaving the records as they are."""
+    field = args.text_field
+    if args.batch_size:
+        def encode_batch(records):
+            encoder.encode_batch([record[field] for record in records])
+            return records
+        return stream.map_batches(encode_batch, args.batch_size)
+    return stream.peek(lambda record: encoder(record[field]))
+
+def _list_fields(args):
+    return args.list_fields or args.count_fields or args.count_field_values
 
 def _main(args):
-    list_fields = args.list_fields or args.count_fields or args.count_field_values
+    _show_results(args, *_run(args))
+
+def _run(args):
+    """
+    Runs the pipeline over the files, showing records, pairs and
+    conversations on the way. Returns the accumulators (reddit stats, field
+    stats and encoder) for `_show_results`.
+    """
+    list_fields = _list_fields(args)
     # Set up the stream ...
-    stream = read_records(*args.file)
-    if args.read_max is not None:
-        stream = stream.take(args.read_max)
+    stream = read_records(*args.file, workers=args.workers, ordered=not args.unordered,
+                          cache_dir=args.cache_dir, fields=_read_fields(args),
+                          prefilter=_raw_line_filter(args), limit=args.read_max,
+                          prefetch=args.prefetch, byte_range=getattr(args, 'byte_range', None))
     if args.ignore_deleted:
         stream = stream.filter(not_deleted)
     if args.process_max is not None:
         stream = stream.take(args.process_max)
     stream = stream.filter(_subreddit_filter(args))
     stream = stream.filter(_field_filter(args))
-    reddit_stats = nop
+    reddit_stats = None
     if args.summary:
         reddit_stats = RedditStatsAccumulator()
         stream = stream.map(reddit_stats)
-    stats = StatsAccumulator(track_values=args.count_field_values)
+    stats = StatsAccumulator(track_values=args.count_field_values, max_exact_values=args.max_exact_values or None,
+                             top_values=args.top_values)
     stream = stream.map(stats) if list_fields else stream
-    stream = stream.map(_preprocessor_pipeline(args))
-    if args.max_length:
-        stream = stream.filter(max_text_length(args.max_length))
-    if args.min_length:
-        stream = stream.filter(min_text_length(args.min_length))
-    encoder = Encoder()
-    stream = stream.map(wrap(encoder)) if args.vocab else stream
+    if args.batch_size:
+        pipeline = _preprocessor_pipeline(args, batches=True)
+        if args.preprocess_workers > 1:
+            # The workers get whole batches.
+            stream = (stream.batch(args.batch_size)
+                .parallel_map(pipeline, workers=args.preprocess_workers, chunksize=1)
+                .flat_map(lambda records: records)
+            )
+        else:
+            stream = stream.map_batches(pipeline, args.batch_size)
+        for p in _length_filters(args):
+            stream = stream.filter_batches(batched(p), args.batch_size)
+    else:
+        if args.preprocess_workers > 1:
+            stream = stream.parallel_map(_preprocessor_pipeline(args), workers=args.preprocess_workers)
+        else:
+            stream = stream.map(_preprocessor_pipeline(args))
+        for p in _length_filters(args):
+            stream = stream.filter(p)
+    if args.approx:
+        encoder = ApproxEncoder(args.max_vocab)
+    elif args.load_vocab is not None:
+        encoder = Encoder.load(args.load_vocab)
+    else:
+        encoder = Encoder()
+    if args.vocab:
+        stream = _encode(stream, encoder, args)
     if args.show_records:
         stream = stream.peek(println)
     if args.pairs:
         stream = stream.peek(_show_pairs(args.keep_parent))
     if args.conversations:
-        _show_conversations(stream, show_header=args.show_header)
+        _show_conversations(stream, show_header=args.show_header, max_age=args.thread_age)
     else:
         _ = stream.count()  # consume stream
-    # Show the results ...
+    return (reddit_stats, stats, encoder)
+
+def _show_results(args, reddit_stats, stats, encoder):
     if args.vocab:
         show_vocab(encoder, sort_by=args.vocab_order, reverse=args.reverse, brief=args.brief)
+        if args.save_vocab is not None:
+            encoder.save(args.save_vocab)
     if args.summary:
         #_show_summary(reddit_stats)
         reddit_stats.show()
-    if list_fields:
+    if _list_fields(args):
         stats.show(args.count_fields)
 
+def _jobs(args):
+    """
+    Splits the input into jobs for `_main_parallel`, as (file, byte range)
+    pairs: a job per file, and if there are fewer files than jobs, the plain
+    (uncompressed) files are split into byte ranges as well.
+    """
+    if len(args.file) >= args.jobs:
+        return [(filename, None) for filename in args.file]
+    parts = -(-args.jobs // len(args.file))
+    jobs = []
+    for filename in args.file:
+        if filename.endswith('.bz2') or filename.endswith('.gz'):
+            jobs.append((filename, None))
+        else:
+            jobs.extend((filename, byte_range) for byte_range in split_file(filename, parts))
+    return jobs
+
+def _main_parallel(args):
+    """
+    Runs `_run` on parts of the input (see `_jobs`) in args.jobs worker
+    processes, and merges the accumulators they return, in order (so the
+    results are the same as with a single process).
+    """
+    def run_job(job):
+        job_args = argparse.Namespace(**vars(args))
+        (job_args.file, job_args.byte_range) = ([job[0]], job[1])
+        job_args.workers = 1
+        job_args.preprocess_workers = 1
+        if job[1] is not None:
+            job_args.cache_dir = None
+        return _run(job_args)
+    results = None
+    for result in map_shards(run_job, _jobs(args), args.jobs):
+        if results is None:
+            results = result
+        else:
+            for (total, part) in zip(results, result):
+                if total is not None:
+                    total.merge(part)
+    _show_results(args, *results)
+
+def _main_sharded(args):
+    """
+    Partitions the files by thread (see `partition`), and runs `_main` on
+    each shard in a worker process. The output of each shard is collected,
+    and printed shard by shard.
+    """
+    def run_shard(path):
+        shard_args = argparse.Namespace(**vars(args))
+        shard_args.file = [path]
+        shard_args.shards = None
+        shard_args.read_max = None
+        shard_args.cache_dir = None
+        shard_args.prefetch = None
+        shard_args.workers = 1
+        shard_args.preprocess_workers = 1
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            _main(shard_args)
+        return out.getvalue()
+    with tempfile.TemporaryDirectory(dir=args.shard_dir) as directory:
+        paths = partition(*args.file, shards=args.shards, directory=directory, workers=args.workers,
+                          prefilter=_raw_line_filter(args), limit=args.read_max)
+        for output in map_shards(run_shard, paths, args.workers):
+            sys.stdout.write(output)
+
 if __name__ == '__main__':
     description = """
     Parse and transform reddit comments (or other JSON data).  Useful
     both for exploring the data set and for doing actual preprocessing.
     Can read JSON from plain text or BZip2-compressed files.
-    All operations EXCEPT FOR `--conversations` can essentially handle
-    arbitrarily large amounts of data.  (More data will take more time,
+    All operations EXCEPT FOR `--conversations` (without `--thread-age`
+    or `--shards`) can essentially handle arbitrarily large amounts of data.  (More data will take more time,
     but you won't run out of memory.)
 
     The following options are only relevant to reddit comments
@@ -308,20 +600,21 @@ if __name__ == '__main__':
     epilog = """
     Summary, pairs, vocab, list fields, and conversations CAN all
     be combined.
-    But `--conversations` needs O(n) memory and O(n²) time.
-    So don't use that if you plan to process lots of data.
+    But `--conversations` needs O(n) memory (and O(n) time), unless
+    using `--thread-age` or `--shards`.
     The others need (more or less) O(1) memory and O(n) time.
     An exception that could potentially cause problems is listing
     fields, especially with `--count-field-values`, since they need to
     accumulate data, but it shoudln't be a problem in most cases.
-    (For example, counting how often different comment bodies appear
-    would be a very stupid idea unless the data set is small.)
+    (Fields with more than `--max-exact-values` different values, like
+    the comment bodies, are only counted approximately, in fixed memory.)
     Summary is the only one that will not potentially produce millions
     of lines of output.
 
     Note that, when reading BZip2-compressed files, the processing
     time will almost certainly be completely dominated by the
-    decompression.
+    decompression. Use `--workers N` to decompress several files at
+    once (or, for a single file, several parts of it).
     """
     parser = argparse.ArgumentParser(description=description, epilog=epilog)
     parser.add_argument('file', nargs='+', help='the files you want to process (plain or .bz2). Separate from previous args with -- if necessary.')
@@ -334,12 +627,19 @@ if __name__ == '__main__':
     parser.add_argument('--show-records', action='store_true', help='print the records')
     parser.add_argument('--read-max', type=int, help='read at most this many records from files')
     parser.add_argument('--process-max', type=int, help='process at most this many records (same as --read-max when not ignoring deleted)')
+    parser.add_argument('--workers', type=int, default=1, help='read (and decompress) up to this many files in parallel, each in its own process. With a single .bz2 file, its blocks are decompressed in parallel instead.')
+    parser.add_argument('--prefetch', type=int, help='read the files on a background thread, up to this many batches of lines ahead (decompression then overlaps with the processing)')
+    parser.add_argument('--cache-dir', help='cache the parsed records in this directory, so that the next run over the same files is much faster')
+    parser.add_argument('--jobs', type=int, metavar='N', help='split the files (and plain files into parts) between N worker processes, and combine their results (for --summary, --list-fields and --vocab)')
+    parser.add_argument('--unordered', action='store_true', help='with --workers, pass on records from whichever file is ready first instead of keeping the file order (fine for --summary, --vocab, --list-fields; not for --pairs or --conversations)')
     # Not offering a --print-max. That's what less is for.
 
     fields = parser.add_argument_group(title='List fields', description='List the different fields')
     fields.add_argument('--list-fields', action='store_true', help='show the set of fields')
     fields.add_argument('--count-fields', action='store_true', help='show how often the fields appear in records')
-    fields.add_argument('--count-field-values', action='store_true', help='show the values that fields take on (may potentially use lots of memory')
+    fields.add_argument('--count-field-values', action='store_true', help='show the values that fields take on (and how often)')
+    fields.add_argument('--max-exact-values', type=int, default=10000, metavar='N', help='with --count-field-values, only count the values of fields with at most N different values exactly (default: 10000). For other fields, show an estimate of the number of different values, and the most common ones, in fixed memory. 0 means no limit.')
+    fields.add_argument('--top-values', type=int, default=20, metavar='K', help='the number of most common values to show for fields with too many values (default: 20)')
 
     fields.add_argument('--distinct-keys', action='store_true', help="don't repeat fields")
     fields.add_argument('--distinct-values', action='store_true', help="don't repeat field values")
@@ -355,14 +655,21 @@ if __name__ == '__main__':
     mutex.add_argument('--by-word', action='store_const', dest='vocab_order', const='word', help='sort alphabetically by word')
     mutex.add_argument('--brief', action='store_true', help="only summarize; don't list the full vocabulary")
     vocab.add_argument('--reverse', action='store_true', help='reversed sorting order')
+    vocab.add_argument('--approx', action='store_true', help='count the vocabulary approximately, in a fixed amount of memory, keeping only (about) the --max-vocab most frequent words. Also shows the OOV rate (the fraction of words left out).')
+    vocab.add_argument('--max-vocab', type=int, default=100000, metavar='V', help='the size of the vocabulary with --approx (default: 100000)')
+    vocab.add_argument('--save-vocab', metavar='FILE', help='save the vocabulary (and the counts) to a binary file')
+    vocab.add_argument('--load-vocab', metavar='FILE', help='start from a vocabulary saved with --save-vocab')
 
     pairs = parser.add_argument_group(title='Pairs', description='Show all comment-reply pairs.')
     pairs.add_argument('--pairs', action='store_true', help='list all comment pairs (long). Could be redirected to a file as a separate preprocessing step. (reddit only)')
     pairs.add_argument('--keep-parent', action='store_true', help='by default, the parent ID is transformed to match the comment ID of the parent. Set this to keep the original parent ID.')
 
     conv = parser.add_argument_group(title='Conversations', description='Print the discussion thread reconstruction')
-    conv.add_argument('--conversations', action='store_true', help='show conversations (cannot handle large data sets). (reddit only)')
+    conv.add_argument('--conversations', action='store_true', help='show conversations (keeps all comments in memory, unless using --thread-age or --shards). (reddit only)')
     conv.add_argument('--no-header', action='store_false', dest='show_header', help="don't show a header at the top of comments")
+    conv.add_argument('--thread-age', type=float, help='show each thread as soon as it has had no new comments for this many seconds (by created_utc), so that only the open threads are kept in memory. Threads are then shown in the order they are completed.')
+    conv.add_argument('--shards', type=int, help='split the comments by thread into this many shards first, and show the conversations of the shards in parallel (with --workers processes). Only needs memory for the largest shard.')
+    conv.add_argument('--shard-dir', help='where to put the temporary shard files')
 
     preproc = parser.add_argument_group(title='Preprocessing', description='Do preprocessing on body text and/or remove xor keep certain fields.')
     strip_or_keep = preproc.add_mutually_exclusive_group()
@@ -371,10 +678,13 @@ if __name__ == '__main__':
     preproc.add_argument('--trim-whitespace', action='store_true', help='remove excess whitespace from comment bodies, both at the start and end, but also within the text')
     preproc.add_argument('--strip-specials', action='store_true', help='remove special characters from comment bodies')
     preproc.add_argument('--tokenize', action='store_true', help='split into words')
+    preproc.add_argument('--tokenizer', choices=['split', 'reddit'], default='split', help="how --tokenize splits: at whitespace (split, the default), or into words, punctuation, URLs, emoticons etc., dropping markdown (reddit; see tokenizer.py)")
     preproc.add_argument('--strip-digits', action='store_true', help='remove digits from comment bodies')
     preproc.add_argument('--to-lower', action='store_true', help='transform comment bodies to lower case')
     preproc.add_argument('--min-length', type=int, help='minimum length')
     preproc.add_argument('--max-length', type=int, help='maximum length')
+    preproc.add_argument('--preprocess-workers', type=int, default=1, help='do the text preprocessing in this many worker processes (keeps the order)')
+    preproc.add_argument('--batch-size', type=int, help='do the text preprocessing and length filtering on this many records at a time (less overhead per record; with --preprocess-workers, the workers get whole batches)')
 
     strip_or_keep.add_argument('--strip-fields', nargs='+', help='strip these fields')
     strip_or_keep.add_argument('--keep-fields', nargs='+', help='keep these fields')
@@ -384,4 +694,20 @@ if __name__ == '__main__':
     mutex.add_argument('--keep-subreddits', nargs='+', help='keep comments from subreddit(s) (reddit only)')
 
     args = parser.parse_args()
-    _main(args)
+    if args.approx and (args.save_vocab is not None or args.load_vocab is not None):
+        parser.error('--approx cannot be used with --save-vocab or --load-vocab')
+    if args.jobs is not None:
+        if args.conversations or args.pairs or args.show_records or args.shards is not None:
+            parser.error('--jobs cannot be used with --conversations, --pairs, --show-records or --shards')
+        if args.read_max is not None or args.process_max is not None or args.load_vocab is not None:
+            parser.error('--jobs cannot be used with --read-max, --process-max or --load-vocab')
+        _main_parallel(args)
+    elif args.shards is not None:
+        if not args.conversations:
+            parser.error('--shards needs --conversations')
+        if args.summary or args.vocab or args.list_fields or args.count_fields or args.count_field_values \
+                or args.pairs or args.show_records or args.process_max is not None:
+            parser.error('--shards only works with --conversations (and preprocessing)')
+        _main_sharded(args)
+    else:
+        _main(args)
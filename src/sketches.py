@@ -0,0 +1,226 @@
+import heapq
+import math
+from array import array
+from collections import Counter
+from hashlib import blake2b
+from operator import add
+
+"""
+Fixed-size summaries of streams too large (or with too many distinct items)
+to count exactly, like the tokens of a few TB of comments.
+
+- `SpaceSaving` keeps counters for (at most) a fixed number of items, and
+  finds the most frequent ones (the "heavy hitters").
+- `CountMinSketch` estimates the count of any item, in a fixed amount of
+  memory, never underestimating.
+- `HyperLogLog` estimates the number of distinct items.
+- `ValueSketch` combines a HyperLogLog and a SpaceSaving summary, for the
+  values of a field.
+
+Both can take counts in bulk (e.g. from a `collections.Counter` of a batch),
+which is much faster than adding items one at a time.
+"""
+
+def stable_hash(item):
+    """A 64-bit hash of a string that is the same in every process and run."""
+    digest = blake2b(item.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+class SpaceSaving:
+    """
+    The Space-Saving algorithm, with counters for at most 2 * capacity items.
+    When they are all in use, only the capacity items with the highest counts
+    are kept, and the highest count thrown away becomes the floor: new items
+    start counting from there (since they could have been seen that often).
+    So counts are overestimates, by at most the floor, which is at most
+    total / capacity. Any item that occurs more often than that is in the
+    summary. The overestimate for each item (the floor when it was added) is
+    kept in errors, so count - error is a lower bound.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        self.total = 0
+
+    def update(self, counts):
+        """Add a mapping from items to how often they occurred."""
+        current = self.counts
+        floor = self.floor
+        for (item, n) in counts.items():
+            if item in current:
+                current[item] += n
+            else:
+                current[item] = floor + n
+                self.errors[item] = floor
+            self.total += n
+            if len(current) >= 2 * self.capacity:
+                self._compact()
+                (current, floor) = (self.counts, self.floor)
+
+    def add(self, item, n=1):
+        self.update({item: n})
+
+    def _compact(self):
+        keep = heapq.nlargest(self.capacity + 1, self.counts.items(), key=lambda kv: kv[1])
+        self.floor = max(self.floor, keep.pop()[1])
+        self.counts = dict(keep)
+        self.errors = {item: self.errors[item] for item in self.counts}
+
+    def merge(self, other):
+        """
+        Add the counts of another summary (of the same capacity). Items
+        missing from one of them could have occurred up to its floor times.
+        """
+        (counts, other_counts) = (self.counts, other.counts)
+        merged = {item: n + other_counts.get(item, other.floor) for (item, n) in counts.items()}
+        errors = {item: e + other.errors.get(item, other.floor) for (item, e) in self.errors.items()}
+        for (item, n) in other_counts.items():
+            if item not in counts:
+                merged[item] = n + self.floor
+                errors[item] = other.errors[item] + self.floor
+        self.counts = merged
+        self.errors = errors
+        self.floor += other.floor
+        self.total += other.total
+        if len(merged) >= 2 * self.capacity:
+            self._compact()
+
+    def top(self, k):
+        """The (at most) k items with the highest counts, as (item, count) pairs."""
+        return heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1])
+
+    def lower_bound(self, item):
+        """How often the item certainly occurred."""
+        return self.counts.get(item, 0) - self.errors.get(item, 0)
+
+class CountMinSketch:
+    """
+    Estimates how often items occurred, with depth rows of width counters.
+    An estimate is never too low, and with probability 1 - e^-depth it is
+    too high by at most e * total / width.
+    """
+
+    def __init__(self, width=1 << 18, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def _columns(self, item):
+        h = stable_hash(item)
+        (h1, h2) = (h & 0xffffffff, (h >> 32) | 1)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def update(self, counts):
+        """Add a mapping from items to how often they occurred."""
+        rows = self.rows
+        for (item, n) in counts.items():
+            for (row, column) in zip(rows, self._columns(item)):
+                row[column] += n
+            self.total += n
+
+    def add(self, item, n=1):
+        self.update({item: n})
+
+    def merge(self, other):
+        """Add the counts of another sketch (of the same width and depth)."""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('cannot merge sketches of different sizes')
+        self.rows = [array('Q', map(add, row, other_row)) for (row, other_row) in zip(self.rows, other.rows)]
+        self.total += other.total
+
+    def estimate(self, item):
+        return min(row[column] for (row, column) in zip(self.rows, self._columns(item)))
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct items (strings), with 2^precision
+    one-byte registers. The standard error is about 1.04 / sqrt(2^precision):
+    0.8% for the default of 16 kB.
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        h = stable_hash(item)
+        bits = 64 - self.precision
+        index = h >> bits
+        # The position of the first 1 bit in the rest of the hash.
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Add the items of another HyperLogLog (of the same precision)."""
+        if other.precision != self.precision:
+            raise ValueError('cannot merge HyperLogLogs of different precisions')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting).
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+class ValueSketch:
+    """
+    The number of distinct values (`HyperLogLog`) and the most frequent ones
+    (`SpaceSaving`, with 10 * top counters) of a stream of values, which can
+    be anything hashable. Values are hashed by their repr, and counted per
+    batch of batch_size different values first.
+    """
+
+    def __init__(self, top=20, precision=14, batch_size=10000):
+        self.distinct = HyperLogLog(precision)
+        self.heavy_hitters = SpaceSaving(10 * top)
+        self.batch_size = batch_size
+        self.pending = Counter()
+
+    def add(self, value):
+        pending = self.pending
+        pending[value] += 1
+        if len(pending) >= self.batch_size:
+            self._flush()
+
+    def update(self, counts):
+        """Add a mapping from values to how often they occurred."""
+        self._flush()
+        self.pending = Counter(counts)
+        self._flush()
+
+    def _flush(self):
+        for value in self.pending:
+            self.distinct.add(repr(value))
+        self.heavy_hitters.update(self.pending)
+        self.pending = Counter()
+
+    def merge(self, other):
+        self._flush()
+        other._flush()
+        self.distinct.merge(other.distinct)
+        self.heavy_hitters.merge(other.heavy_hitters)
+
+    def count_distinct(self):
+        """The estimated number of distinct values."""
+        self._flush()
+        return self.distinct.estimate()
+
+    def top(self, k):
+        """
+        The (at most) k most frequent values, with their (over)estimated
+        counts. Only values that certainly occurred more often than the
+        floor (more often than any value the summary lost track of) are
+        included, since the others' counts may be mostly overestimate.
+        """
+        self._flush()
+        summary = self.heavy_hitters
+        return [(value, n) for (value, n) in summary.top(k) if summary.lower_bound(value) > summary.floor]
@@ -0,0 +1,205 @@
+import math
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from itertools import islice
+from id_set import IdSet, is_id
+
+"""
+Dictionary-like stores for when a plain dict could get too big.
+"""
+
+_MISSING = object()
+
+class BloomFilter:
+    """
+    A set that can only say "definitely not present" or "probably present",
+    with a fixed size: about 10 bits per item for a 1% false positive rate.
+    (Uses Python's built-in hash, so it only works within one process.)
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.capacity = capacity
+        self.count = 0
+
+    def _indices(self, key):
+        h = hash(key)
+        h1 = h & 0xffffffff
+        h2 = ((h >> 32) & 0xffffffff) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for i in self._indices(key):
+            bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for i in self._indices(key):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+class GrowingBloomFilter:
+    """
+    A `BloomFilter` without a limit on the number of items: once capacity
+    items have been added, another filter (twice as big, and with half the
+    error rate) is started, and so on. The false positive rate stays below
+    error_rate overall, while the memory stays about proportional to the
+    number of items.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.filters = [BloomFilter(capacity, error_rate / 2)]
+        self.error_rate = error_rate / 2
+
+    def add(self, key):
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            self.error_rate /= 2
+            last = BloomFilter(2 * last.capacity, self.error_rate)
+            self.filters.append(last)
+        last.add(key)
+
+    def __contains__(self, key):
+        return any(key in f for f in self.filters)
+
+class SpillingDict:
+    """
+    A dict that keeps (at most) max_items of the most recently added items in
+    memory, and moves older ones to an sqlite database on disk.
+
+    Meant for things like looking up the parents of comments, where almost
+    all lookups are for recently added items. A bloom filter over the keys on
+    disk (which starts out with room for spill_capacity keys, and grows from
+    there) avoids going to the database for keys that were never added at all.
+    Values are pickled on disk. The database is a temporary file (in
+    directory, if given) that is removed by `close`.
+    """
+
+    def __init__(self, max_items=1000000, directory=None, spill_capacity=None):
+        self.max_items = max_items
+        self.recent = {}
+        self.spilled = GrowingBloomFilter(spill_capacity or max(1000, 10 * max_items))
+        self.spill_count = 0
+        (fd, self.path) = tempfile.mkstemp(suffix='.sqlite', dir=directory)
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE spilled (key TEXT PRIMARY KEY, value BLOB)')
+
+    def __setitem__(self, key, value):
+        recent = self.recent
+        if key in recent:
+            del recent[key]
+        recent[key] = value
+        if len(recent) > self.max_items:
+            self._spill(max(1, self.max_items // 10))
+
+    def _spill(self, n):
+        """Move the n oldest items to disk."""
+        items = []
+        for key in list(islice(self.recent, n)):
+            items.append((key, pickle.dumps(self.recent.pop(key))))
+            self.spilled.add(key)
+        self.db.executemany('INSERT OR REPLACE INTO spilled VALUES (?, ?)', items)
+        self.spill_count += len(items)
+
+    def _load(self, key):
+        if key not in self.spilled:
+            return _MISSING
+        row = self.db.execute('SELECT value FROM spilled WHERE key = ?', (key,)).fetchone()
+        return _MISSING if row is None else pickle.loads(row[0])
+
+    def __contains__(self, key):
+        return key in self.recent or self._load(key) is not _MISSING
+
+    def __getitem__(self, key):
+        if key in self.recent:
+            return self.recent[key]
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def close(self):
+        self.db.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class EvictingDict:
+    """
+    A dict that forgets old items: those added more than max_age before the
+    current time (see `advance`), and the oldest ones once there are more
+    than max_items. Either limit can be None.
+
+    Meant for buffering potential parents of comments, since almost all
+    replies come within days of their parent. Evicted keys that are reddit
+    IDs are remembered (exactly) in an `IdSet`, and every membership test for
+    one of them counts as `lost`. Other keys (like the 't3_' IDs of the posts
+    that top-level comments reply to) are never remembered, and never count,
+    even if they only differ from an evicted ID by the '_'.
+    """
+
+    def __init__(self, max_items=None, max_age=None):
+        self.max_items = max_items
+        self.max_age = max_age
+        self.items = OrderedDict()  # key -> (time added, value), oldest first
+        self.now = None
+        self.evicted = IdSet()
+        self.evicted_count = 0
+        self.lost = 0
+
+    def advance(self, now):
+        """Move the clock forward to now (if it is later), evicting old items."""
+        if self.now is not None and now <= self.now:
+            return
+        self.now = now
+        if self.max_age is None:
+            return
+        limit = now - self.max_age
+        items = self.items
+        while items:
+            (time, _) = items[next(iter(items))]
+            if time is not None and time >= limit:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        (key, _) = self.items.popitem(last=False)
+        if is_id(key):
+            self.evicted.add(key)
+        self.evicted_count += 1
+
+    def __setitem__(self, key, value):
+        items = self.items
+        if key in items:
+            items.move_to_end(key)
+        items[key] = (self.now, value)
+        if self.max_items is not None and len(items) > self.max_items:
+            self._evict_oldest()
+
+    def __contains__(self, key):
+        if key in self.items:
+            return True
+        if is_id(key) and key in self.evicted:
+            self.lost += 1
+        return False
+
+    def __getitem__(self, key):
+        return self.items[key][1]
+
+    def __len__(self):
+        return len(self.items)
@@ -1,42 +1,194 @@
+from itertools import compress
 from util import *
+from workers import parallel_map
+
+"""
+Streams don't apply map, filter, peek, take, drop, take_while and drop_while
+right away. Instead, they are recorded, and when the stream is consumed, a
+run of such steps is compiled ("fused") into a single loop. So instead of one
+generator per step, with every element passing through all of them, there is
+one loop per stream, with a plain function call per step. Terminal operations
+like count and foreach also get their own compiled loops, so they don't even
+need a generator.
+
+The compiled loops are cached by the sequence of steps (and terminal
+operation), so each kind of pipeline is only compiled once.
+"""
+
+# Code for each kind of step. `a` is the step's argument (the function or
+# count), `c` and `d` are its own local state (for counting and flags).
+_STEP_CODE = {
+    'map': ['x = {a}(x)'],
+    'filter': ['if not {a}(x): continue'],
+    'peek': ['{a}(x)'],
+    'take': ['if {c} >= {a}: break', '{c} += 1'],
+    'drop': ['if {c} < {a}:', '    {c} += 1', '    continue'],
+    'take_while': ['if not {a}(x): break'],
+    'drop_while': ['if {d}:', '    if {a}(x): continue', '    {d} = False'],
+}
+
+# What to do with the elements that make it through all the steps.
+_SINK_CODE = {
+    'yield': 'yield x',
+    'count': 'n += 1',
+    'foreach': 'sink(x)',
+}
+
+_fused = {}
+
+def _fuse(kinds, sink):
+    """Compile (or get the cached) loop for the given kinds of steps."""
+    key = (kinds, sink)
+    if key not in _fused:
+        args = ['a' + str(i) for i in range(len(kinds))]
+        lines = ['def fused(source, sink, ' + ', '.join(args + ['']) + '):']
+        for (i, kind) in enumerate(kinds):
+            if kind in ('take', 'drop'):
+                lines.append(f'    c{i} = 0')
+            elif kind == 'drop_while':
+                lines.append(f'    d{i} = True')
+        lines.append('    n = 0')
+        lines.append('    for x in source:')
+        for (i, kind) in enumerate(kinds):
+            for line in _STEP_CODE[kind]:
+                lines.append('        ' + line.format(a=f'a{i}', c=f'c{i}', d=f'd{i}'))
+        lines.append('        ' + _SINK_CODE[sink])
+        # Stop right away when a take is done, instead of pulling in (and
+        # maybe doing work on) another element first.
+        for (i, kind) in enumerate(kinds):
+            if kind == 'take':
+                lines.append(f'        if c{i} >= a{i}: break')
+        lines.append('    return n')
+        namespace = {}
+        exec('\n'.join(lines), namespace)
+        _fused[key] = namespace['fused']
+    return _fused[key]
+
+_CHAIN_STEPS = {
+    'map': map,
+    'filter': filter,
+    'peek': lambda f, it: map(consumer_to_function(f), it),
+    'take': take,
+    'drop': drop,
+    'take_while': take_while,
+    'drop_while': drop_while,
+}
+
+def _chain(source, ops):
+    """The steps as a chain of generators (what fusing replaces)."""
+    it = source
+    for (kind, a) in ops:
+        it = _CHAIN_STEPS[kind](a, it)
+    return it
 
 class Stream():
     """
     General purpose (minimal) stream implementation.
     Mostly imitating java.util.stream.Stream.
     """
+
+    # Set to False to use a chain of generators instead of fused loops.
+    fusion = True
+
     def __init__(self, iterable):
-        self.base = iter(iterable)
+        self.source = iter(iterable)
+        self.ops = ()
+        self._base = None
+
+    @property
+    def base(self):
+        """The iterator over the elements of this stream."""
+        if self._base is None:
+            if not self.ops:
+                self._base = self.source
+            elif Stream.fusion:
+                self._base = self._run('yield')
+            else:
+                self._base = _chain(self.source, self.ops)
+        return self._base
+
+    def _run(self, sink, f=None):
+        kinds = tuple(kind for (kind, _) in self.ops)
+        return _fuse(kinds, sink)(self.source, f, *(a for (_, a) in self.ops))
+
+    def _then(self, kind, a):
+        """A new stream, with one more step."""
+        if self._base is not None:
+            # Already being consumed, so continue from where it is.
+            s = Stream(self._base)
+        else:
+            s = Stream(self.source)
+            s.ops = self.ops
+        s.ops = s.ops + ((kind, a),)
+        return s
 
     def map(self, f):
-        return Stream(map(f, self.base))
+        return self._then('map', f)
 
     def flat_map(self, f):
         return Stream(flat_map(f, self.base))
 
     def filter(self, f):
-        return Stream(filter(f, self.base))
+        return self._then('filter', f)
 
     def peek(self, f):
-        return self.map(consumer_to_function(f))
+        return self._then('peek', f)
+
+    def batch(self, n):
+        """A stream of lists of n elements (the last one may be shorter)."""
+        return Stream(batch(n, self.base))
+
+    def map_batches(self, f, n=1000):
+        """
+        Like map, but f is applied to lists of (up to) n elements at a time,
+        and should return a list of results, which are then streamed as
+        separate elements again. See `util.batched` and `util.wrap_batch`.
+        """
+        return self.batch(n).flat_map(f)
+
+    def filter_batches(self, p, n=1000):
+        """
+        Like filter, but p is applied to lists of (up to) n elements at a
+        time, and should return a list of booleans (one for each element).
+        See `util.batched`.
+        """
+        return self.batch(n).flat_map(lambda xs: compress(xs, p(xs)))
+
+    def parallel_map(self, f, workers=None, chunksize=100, ordered=True):
+        """
+        Like map, but f is applied in parallel by a pool of worker
+        processes. See `workers.parallel_map`. f must not rely on side
+        effects, since it runs in other processes.
+        """
+        return Stream(parallel_map(f, self.base, workers, chunksize, ordered))
+
+    def prefetch(self, n, batch_size=1000):
+        """
+        Compute the elements of this stream (so far) on a background thread,
+        up to n batches of batch_size elements ahead. See `util.prefetch`.
+        """
+        return Stream(prefetch(n, self.base, batch_size))
 
     def foreach(self, f):
-        for e in self.base: f(e)
+        if self._base is None and self.ops and Stream.fusion:
+            self._run('foreach', f)
+        else:
+            for e in self.base: f(e)
 
     def concat(self, s):
         return Stream(concat(self, s))
 
     def take(self, n):
-        return Stream(take(n, self))
+        return self._then('take', n)
 
     def take_while(self, p):
-        return Stream(take_while(p, self))
+        return self._then('take_while', p)
 
     def drop(self, n):
-        return Stream(drop(n, self))
+        return self._then('drop', n)
 
     def drop_while(self, p):
-        return Stream(drop_while(p, self))
+        return self._then('drop_while', p)
 
     def distinct(self):
         def f():
@@ -75,6 +227,8 @@ class Stream():
         return d
 
     def count(self):
+        if self._base is None and self.ops and Stream.fusion:
+            return self._run('count')
         n = 0
         for _ in self.base:
             n += 1
@@ -0,0 +1,58 @@
+import unittest
+import bz2
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import bz2_blocks
+
+def comment_lines(n):
+    # Some non-ASCII text too, so that characters get split between blocks.
+    return ['{"id": "c%d", "body": "höhö %s"}\n' % (i, 'blah ' * (i % 50)) for i in range(n)]
+
+class TestBz2Blocks(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.lines = comment_lines(20000)
+        data = ''.join(self.lines).encode('utf-8')
+        # Level 1 means 100k blocks, so this gives quite a few of them.
+        # Two concatenated streams, like pbzip2 output.
+        self.filename = os.path.join(self.dir.name, 'comments.bz2')
+        with open(self.filename, 'wb') as f:
+            f.write(bz2.compress(data, 1))
+            f.write(bz2.compress(data[:300000], 1))
+        self.expected = list(bz2.open(self.filename, 'rt'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_block_ranges(self):
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        ranges = list(bz2_blocks.block_ranges(data))
+        self.assertGreater(len(ranges), 2)
+        blocks = [bz2.decompress(bz2_blocks.block_to_stream(data[start // 8:], start, end))
+                  for (start, end) in ranges]
+        self.assertEqual(''.join(self.expected).encode('utf-8'), b''.join(blocks))
+
+    def test_open_bz2_parallel(self):
+        with bz2_blocks.open_bz2_parallel(self.filename, workers=3) as f:
+            lines = list(f)
+        self.assertEqual(self.expected, lines)
+
+    def test_false_marker(self):
+        # Split a real block in two, as a false marker would.
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        ranges = list(bz2_blocks.block_ranges(data))
+        (start, end) = ranges[1]
+        middle = (start + end) // 2
+        ranges[1:2] = [(start, middle), (middle, end)]
+        tasks = [(self.filename, start, end) for (start, end) in ranges]
+        results = iter(map(bz2_blocks._decompress_block, tasks))
+        blocks = list(bz2_blocks._repair(self.filename, results))
+        self.assertEqual(''.join(self.expected).encode('utf-8'), b''.join(blocks))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+import unittest
+import json
+import os
+import random
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import data_loader
+import record_cache
+
+COMMENTS = [
+    {'id': 'c1', 'parent_id': 't3_a', 'subreddit': 'programming', 'body': 'first', 'score': 3},
+    {'id': 'c2', 'parent_id': 't1_c1', 'subreddit': 'programming', 'body': '[deleted]', 'score': 1},
+    {'id': 'c3', 'parent_id': 't1_c1', 'subreddit': 'features', 'body': 'third', 'score': -2},
+]
+
+class TestJsonProjection(unittest.TestCase):
+
+    def check(self, line, fields):
+        expected = data_loader.keep_fields(json.loads(line), set(fields))
+        result = data_loader.json_projection(fields)(line)
+        self.assertEqual(expected, result)
+        # In the same order too.
+        self.assertEqual(list(expected.items()), list(result.items()))
+
+    def test_projection(self):
+        for comment in COMMENTS:
+            self.check(json.dumps(comment), ['id', 'body'])
+            self.check(json.dumps(comment, separators=(',', ':')), ['id', 'parent_id', 'score'])
+            self.check(json.dumps(comment), ['missing'])
+            self.check(json.dumps(comment), ['score', 'body', 'id', 'subreddit', 'parent_id'])
+
+    def test_tricky_lines(self):
+        fields = ['id', 'body']
+        # Key-like text inside a string.
+        self.check(r'{"body": "look: \"id\": 5", "id": "c1"}', fields)
+        self.check(r'{"body": "\"id\" : 5", "score": 1}', fields)
+        # Nested objects with the same keys.
+        self.check('{"x": {"id": "nested"}, "id": "c1", "body": "b"}', fields)
+        self.check('{"x": [{"body": "nested"}], "id": "c1"}', fields)
+        # Unusual spacing.
+        self.check('{"id" : "c1", "body":\t"b"}', fields)
+        # Non-string values and escapes.
+        self.check('{"id": null, "body": "a\\\"b\u00e5", "z": [1, 2]}', fields)
+
+class TestPrefilters(unittest.TestCase):
+
+    def test_raw_may_contain(self):
+        p = data_loader.raw_may_contain('programming', 'ßpam')
+        lines = [json.dumps(c) for c in COMMENTS]
+        self.assertEqual([True, True, False], list(map(p, lines)))
+        self.assertTrue(p('{"subreddit": "\\u00dfpam"}'))
+        self.assertTrue(p('{"subreddit": "ßpam"}'))
+
+    def test_raw_field_equals(self):
+        p = data_loader.raw_field_equals('body', '[deleted]')
+        lines = [json.dumps(c) for c in COMMENTS]
+        self.assertEqual([False, True, False], list(map(p, lines)))
+        self.assertTrue(p('{"id":"c1","body":"[deleted]"}'))
+        # Not certain, so not true.
+        self.assertFalse(p('{"body": "x \\"body\\": \\"[deleted]\\""}'))
+        self.assertFalse(p('{"x": {"body": "[deleted]"}, "body": "b"}'))
+
+    def test_read_records_prefilter(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'RC_test')
+            with open(filename, 'w') as f:
+                for comment in COMMENTS:
+                    f.write(json.dumps(comment) + '\n')
+            p = data_loader.raw_may_contain('features')
+            self.assertEqual(COMMENTS[2:], data_loader.read_records(filename, prefilter=p).to_list())
+            # The limit counts lines read, not lines passing the prefilter.
+            self.assertEqual([], data_loader.read_records(filename, prefilter=p, limit=2).to_list())
+
+class TestEncoder(unittest.TestCase):
+
+    SENTENCES = [['a', 'b', 'a'], [], ['c', 'b', '\ud83d', 'dé']]
+
+    def test_encoder(self):
+        encoder = data_loader.Encoder()
+        encoded = [encoder(s) for s in self.SENTENCES]
+        self.assertEqual([[0, 1, 0], [], [2, 1, 3, 4]], [e.tolist() for e in encoded])
+        self.assertEqual('I', encoded[0].typecode)
+        self.assertEqual(['a', 'b', 'c', '\ud83d', 'dé'], encoder.vocab())
+        self.assertEqual(2, encoder.count_word('b'))
+        self.assertEqual([1, 2], encoder.encode(['b', 'x', 'c']).tolist())
+        self.assertEqual([1, 9, 2], encoder.encode(['b', 'x', 'c'], unknown=9).tolist())
+        self.assertEqual(2, encoder.count_word('b'))
+
+    def test_encode_batch(self):
+        encoder = data_loader.Encoder()
+        batch_encoder = data_loader.Encoder()
+        sentences = self.SENTENCES * 3
+        self.assertEqual([encoder(s) for s in sentences], batch_encoder.encode_batch(sentences))
+        self.assertEqual(encoder.vocab(), batch_encoder.vocab())
+        self.assertEqual(encoder.i2count, batch_encoder.i2count)
+
+    def test_save_and_load(self):
+        encoder = data_loader.Encoder()
+        encoder.encode_batch(self.SENTENCES)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'vocab')
+            encoder.save(path)
+            loaded = data_loader.Encoder.load(path)
+            self.assertEqual(encoder.vocab(), loaded.vocab())
+            self.assertEqual(encoder.w2i, loaded.w2i)
+            self.assertEqual(list(encoder.i2count), list(loaded.i2count))
+            # It can go on counting.
+            self.assertEqual([4, 5, 0], loaded(['dé', 'new', 'a']).tolist())
+            self.assertEqual([3, 2, 1, 1, 2, 1], list(loaded.i2count))
+            data_loader.Encoder().save(path)
+            self.assertEqual([], data_loader.Encoder.load(path).vocab())
+
+    def test_merge(self):
+        sentences = self.SENTENCES + [['e', 'a'], ['f']]
+        encoder = data_loader.Encoder()
+        encoder.encode_batch(sentences)
+        merged = data_loader.Encoder()
+        merged.encode_batch(sentences[:2])
+        part = data_loader.Encoder()
+        part.encode_batch(sentences[2:])
+        merged.merge(part)
+        self.assertEqual(encoder.vocab(), merged.vocab())
+        self.assertEqual(encoder.i2count, merged.i2count)
+
+    def test_approx_encoder(self):
+        rng = random.Random(0)
+        sentences = [['w' + str(int(1 / (1 - rng.random()))) for _ in range(10)] for _ in range(5000)]
+        encoder = data_loader.Encoder()
+        encoder.encode_batch(sentences)
+        approx = data_loader.ApproxEncoder(20, batch_size=100)
+        approx.encode_batch(sentences)
+        top = sorted(encoder.vocab(), key=encoder.count_word, reverse=True)[:20]
+        self.assertEqual(top[:10], approx.vocab()[:10])
+        self.assertEqual(encoder.total(), approx.total())
+        in_vocab = sum(encoder.count_word(w) for w in approx.vocab())
+        self.assertAlmostEqual(1 - in_vocab / encoder.total(), approx.oov_rate(), delta=0.01)
+        for word in approx.vocab():
+            self.assertGreaterEqual(approx.count_word(word), encoder.count_word(word))
+
+    def test_approx_oov_rate(self):
+        approx = data_loader.ApproxEncoder(2)
+        approx(['a', 'a', 'b'])
+        self.assertEqual(0.0, approx.oov_rate())
+        approx(['c', 'c', 'c', 'd'])
+        self.assertEqual(['c', 'a'], approx.vocab())
+        approx(['d', 'd', 'd', 'd'])
+        # 'd' (5 of 11) is in the vocabulary now, instead of 'a' (2).
+        self.assertAlmostEqual(3 / 11, approx.oov_rate())
+
+class TestStatsAccumulator(unittest.TestCase):
+
+    def test_merge(self):
+        stats = data_loader.StatsAccumulator(track_values=True)
+        for comment in COMMENTS:
+            stats(comment)
+        merged = data_loader.StatsAccumulator(track_values=True)
+        merged(COMMENTS[0])
+        part = data_loader.StatsAccumulator(track_values=True)
+        for comment in COMMENTS[1:]:
+            part(comment)
+        merged.merge(part)
+        self.assertEqual(stats.fields, merged.fields)
+        self.assertEqual(stats.field_values, merged.field_values)
+
+    def test_max_exact_values(self):
+        records = [{'id': 'c' + str(i), 'score': i % 3} for i in range(1000)]
+        stats = data_loader.StatsAccumulator(track_values=True, max_exact_values=10)
+        for record in records[:500]:
+            stats(record)
+        part = data_loader.StatsAccumulator(track_values=True, max_exact_values=10)
+        for record in records[500:]:
+            part(record)
+        stats.merge(part)
+        self.assertEqual({'id': 1000, 'score': 1000}, stats.fields)
+        self.assertEqual({0: 334, 1: 333, 2: 333}, stats.field_values['score'])
+        self.assertNotIsInstance(stats.field_values['id'], dict)
+        self.assertAlmostEqual(1000, stats.field_values['id'].count_distinct(), delta=30)
+
+class TestNormalizer(unittest.TestCase):
+
+    TEXTS = ['', '  ', 'Hello, World!', 'a!1!b a1!b  12', ' snake_case\tand\nCamelCase\x1c ',
+             'İstanbul ½ ٣ non\xa0breaking', 'ÉCOLE straße -- 3.14']
+
+    def test_same_as_separate_steps(self):
+        rng = random.Random(0)
+        alphabet = 'aZ09_ !.-\t\n\x1c\xa0éİ½٣ß'
+        texts = self.TEXTS + [''.join(rng.choice(alphabet) for _ in range(rng.randrange(12)))
+                              for _ in range(2000)]
+        steps = [data_loader.keep_alnum(), data_loader.strip_digits(), data_loader.trim_whitespace(),
+                 str.lower, str.split]
+        for i in range(1 << len(steps)):
+            options = [bool(i & (1 << j)) for j in range(len(steps))]
+            expected = data_loader.preprocessor_pipeline([f for (f, on) in zip(steps, options) if on])
+            normalize = data_loader.compile_normalizer(*options)
+            for text in texts:
+                self.assertEqual(expected(text), normalize(text), (options, text))
+
+class TestRecordCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, 'cache')
+        self.filename = os.path.join(self.dir.name, 'RC_test')
+        self.write_comments(COMMENTS)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_comments(self, comments):
+        with open(self.filename, 'w') as f:
+            for comment in comments:
+                f.write(json.dumps(comment) + '\n')
+
+    def cache_path(self):
+        return record_cache.cache_path(self.cache_dir, self.filename)
+
+    def test_cache_is_built_and_used(self):
+        records = data_loader.read_records(self.filename, cache_dir=self.cache_dir).to_list()
+        self.assertEqual(COMMENTS, records)
+        self.assertTrue(record_cache.is_valid(self.cache_path(), self.filename))
+        self.assertEqual(COMMENTS, list(record_cache.read_cache(self.cache_path())))
+        records = data_loader.read_records(self.filename, cache_dir=self.cache_dir).to_list()
+        self.assertEqual(COMMENTS, records)
+
+    def test_fields(self):
+        fields = ['id', 'body']
+        expected = [{'id': c['id'], 'body': c['body']} for c in COMMENTS]
+        records = data_loader.read_records(self.filename, cache_dir=self.cache_dir, fields=fields).to_list()
+        self.assertEqual(expected, records)
+        self.assertTrue(record_cache.is_valid(self.cache_path(), self.filename, ['id']))
+        self.assertFalse(record_cache.is_valid(self.cache_path(), self.filename, ['id', 'score']))
+        self.assertFalse(record_cache.is_valid(self.cache_path(), self.filename))
+        # A subset of the cached fields is read from the cache.
+        records = data_loader.read_records(self.filename, cache_dir=self.cache_dir, fields=['id']).to_list()
+        self.assertEqual([{'id': c['id']} for c in COMMENTS], records)
+
+    def test_stale_cache_is_rebuilt(self):
+        data_loader.read_records(self.filename, cache_dir=self.cache_dir).count()
+        changed = COMMENTS + [{'id': 'c4', 'parent_id': 't1_c3', 'body': 'new'}]
+        self.write_comments(changed)
+        os.utime(self.filename, ns=(0, 0))
+        self.assertFalse(record_cache.is_valid(self.cache_path(), self.filename))
+        records = data_loader.read_records(self.filename, cache_dir=self.cache_dir).to_list()
+        self.assertEqual(changed, records)
+        self.assertTrue(record_cache.is_valid(self.cache_path(), self.filename))
+
+    def test_partial_read_leaves_no_cache(self):
+        data_loader.read_records(self.filename, cache_dir=self.cache_dir).take(1).count()
+        self.assertFalse(os.path.exists(self.cache_path()))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+if __name__ == '__main__':
+    unittest.main()
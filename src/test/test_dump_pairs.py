@@ -0,0 +1,112 @@
+import unittest
+import json
+import os
+import random
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import dump_pairs
+
+def random_comments(n, seed=0):
+    """Comments in threads, with replies (mostly) to recent comments."""
+    rng = random.Random(seed)
+    comments = []
+    for i in range(n):
+        if comments and rng.random() < 0.7:
+            parent_comment = rng.choice(comments[-30:])
+            (parent, link) = ('t1_' + parent_comment['id'], parent_comment['link_id'])
+        else:
+            parent = link = 't3_p' + str(rng.randint(0, 20))
+        body = '[deleted]' if rng.random() < 0.1 else ' comment  number %d ' % i
+        comments.append({'id': 'c%05d' % i, 'parent_id': parent, 'link_id': link, 'body': body,
+                         'created_utc': str(1136074029 + 60*i)})
+    return comments
+
+class TestDumpPairs(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'RC_test')
+        with open(self.filename, 'w') as f:
+            for comment in random_comments(2000):
+                f.write(json.dumps(comment) + '\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_single_pass(self):
+        expected = dump_pairs.get_pairs(self.filename).to_list()
+        self.assertGreater(len(expected), 100)
+        result = dump_pairs.get_pairs_single_pass(self.filename, memory_items=50,
+                                                  spill_dir=self.dir.name).to_list()
+        self.assertEqual(expected, result)
+
+    def test_eviction(self):
+        expected = dump_pairs.get_pairs(self.filename).to_list()
+        store = dump_pairs.EvictingDict(max_items=10000)
+        self.assertEqual(expected, dump_pairs.get_pairs(self.filename, store=store).to_list())
+        self.assertEqual(0, store.lost)
+        # Replies come at most 30 comments (of 60 seconds) after their parent.
+        for max_age in (600, 3600):
+            for single_pass in (False, True):
+                store = dump_pairs.EvictingDict(max_age=max_age)
+                get_pairs = dump_pairs.get_pairs_single_pass if single_pass else dump_pairs.get_pairs
+                result = get_pairs(self.filename, store=store).to_list()
+                self.assertEqual(len(expected) - len(result), store.lost)
+                self.assertEqual(max_age > 1800, store.lost == 0)
+                self.assertEqual([pair for pair in expected if pair in result], result)
+
+    def test_shards(self):
+        expected = dump_pairs.get_pairs(self.filename).to_list()
+        out_file = os.path.join(self.dir.name, 'pairs.txt')
+        for single_pass in (False, True):
+            dump_pairs.dump_pairs_to_file(out_file, self.filename, shards=4, workers=2,
+                                          single_pass=single_pass, shard_dir=self.dir.name)
+            with open(out_file) as f:
+                result = [tuple(line.rstrip('\n').split('\t')) for line in f]
+            self.assertEqual(sorted(expected), sorted(result))
+            self.assertEqual(['RC_test', 'pairs.txt'], sorted(os.listdir(self.dir.name)))
+
+    def test_context_samples(self):
+        pairs = dump_pairs.get_pairs(self.filename).to_list()
+        samples = dump_pairs.get_pairs(self.filename, context=1).to_list()
+        self.assertEqual(pairs, [(context[0], reply) for (context, reply) in samples])
+        comments = [{'id': 'c' + str(i), 'parent_id': 'c' + str(i - 1), 'body': str(i)} for i in range(5)]
+        samples = dump_pairs.context_samples(iter(comments), 3).to_list()
+        self.assertEqual([(('0',), '1'), (('0', '1'), '2'), (('0', '1', '2'), '3'), (('1', '2', '3'), '4')], samples)
+        expected = dump_pairs.get_pairs(self.filename, context=4).to_list()
+        self.assertTrue(any(len(context) == 4 for (context, _) in expected))
+        result = dump_pairs.get_pairs_single_pass(self.filename, context=4, memory_items=50,
+                                                  spill_dir=self.dir.name).to_list()
+        self.assertEqual(expected, result)
+
+    def test_compact_ids(self):
+        expected = dump_pairs.get_pairs(self.filename).to_list()
+        result = dump_pairs.get_pairs(self.filename, compact=True).to_list()
+        self.assertEqual(expected, result)
+        pairs_file = os.path.join(self.dir.name, 'pairs')
+        for _ in range(2):
+            result = dump_pairs.get_pairs(self.filename, pairs_file=pairs_file).to_list()
+            self.assertEqual(expected, result)
+            self.assertTrue(os.path.exists(pairs_file))
+
+    def test_stale_pairs_file(self):
+        pairs_file = os.path.join(self.dir.name, 'pairs')
+        expected = dump_pairs.get_pairs(self.filename).to_list()
+        # A set saved with other read options isn't used...
+        dump_pairs.get_pairs(self.filename, pairs_file=pairs_file, limit=100).to_list()
+        self.assertEqual(expected, dump_pairs.get_pairs(self.filename, pairs_file=pairs_file).to_list())
+        # ...and neither is one saved for another file with the same name
+        # (even if that one is older).
+        with open(self.filename) as f:
+            lines = f.readlines()
+        with open(self.filename, 'w') as f:
+            f.writelines(lines[:100])
+        dump_pairs.get_pairs(self.filename, pairs_file=pairs_file).to_list()
+        with open(self.filename, 'w') as f:
+            f.writelines(lines)
+        os.utime(self.filename, (0, 0))
+        self.assertEqual(expected, dump_pairs.get_pairs(self.filename, pairs_file=pairs_file).to_list())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import os
+import random
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from id_set import IdSet
+
+def random_ids(n, seed=0):
+    """Mostly dense runs of IDs (like a month of comments), and some sparse ones."""
+    rng = random.Random(seed)
+    ids = set()
+    start = int('c0000000', 36)
+    while len(ids) < n:
+        if rng.random() < 0.8:
+            ids.add(start + rng.randrange(100000))
+        else:
+            ids.add(rng.randrange(36 ** 8))
+    return [base36_string(i) for i in ids]
+
+def base36_string(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    s = ''
+    while True:
+        (n, d) = divmod(n, 36)
+        s = digits[d] + s
+        if n == 0:
+            return s
+
+class TestIdSet(unittest.TestCase):
+
+    def check(self, ids, id_set):
+        self.assertEqual(len(ids), len(id_set))
+        for comment_id in ids:
+            self.assertIn(comment_id, id_set)
+        others = set(random_ids(2000, seed=1)) - set(ids)
+        for comment_id in others:
+            self.assertNotIn(comment_id, id_set)
+
+    def test_id_set(self):
+        ids = random_ids(20000)
+        id_set = IdSet(ids)
+        id_set.add(ids[0])
+        self.check(ids, id_set)
+        self.assertNotIn(None, id_set)
+        self.assertNotIn('not an id', id_set)
+
+    def test_not_ids(self):
+        id_set = IdSet(['t3abc', 'c1'])
+        for s in ['t3_abc', ' c1 ', 'c1\n', '+c1', 'C1', '']:
+            self.assertNotIn(s, id_set)
+            with self.assertRaises(ValueError):
+                id_set.add(s)
+        self.assertEqual(2, len(id_set))
+
+    def test_save_and_load(self):
+        ids = random_ids(20000)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'ids')
+            IdSet(ids).save(path)
+            loaded = IdSet.load(path)
+            self.check(ids, loaded)
+            loaded.close()
+            IdSet().save(path)
+            self.assertEqual(0, len(IdSet.load(path)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import partition
+from util import read_file
+from test_dump_pairs import random_comments
+
+class TestPartition(unittest.TestCase):
+
+    def test_partition(self):
+        comments = random_comments(1000)
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'RC_test')
+            with open(filename, 'w') as f:
+                for comment in comments:
+                    f.write(json.dumps(comment) + '\n')
+            paths = partition.partition(filename, shards=3, directory=d)
+            shards = [[json.loads(line) for line in read_file(path)] for path in paths]
+            # Every thread is in one shard, in the original order.
+            for (i, shard) in enumerate(shards):
+                for comment in shard:
+                    self.assertEqual(i, partition.shard_of(comment['link_id'], 3))
+            self.assertEqual(sorted(comments, key=lambda c: c['id']),
+                             sorted(sum(shards, []), key=lambda c: c['id']))
+            for shard in shards:
+                self.assertEqual(sorted(shard, key=lambda c: c['id']), shard)
+            counts = list(partition.map_shards(lambda path: sum(1 for _ in read_file(path)), paths, 2))
+            self.assertEqual([len(shard) for shard in shards], counts)
+
+if __name__ == '__main__':
+    unittest.main()
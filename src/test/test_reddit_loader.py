@@ -0,0 +1,53 @@
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import reddit_loader
+from test_dump_pairs import random_comments
+
+def naive_threads(comments):
+    """What show_conversations used to do, in O(n²)."""
+    comments = list(comments)
+    threads = []
+    def walk(comment, level, thread):
+        comments.remove(comment)
+        thread.append((level, comment))
+        replies = [c for c in comments if c['parent_id'].endswith('_' + comment['id'])]
+        for reply in replies:
+            walk(reply, level + 1, thread)
+    while comments:
+        thread = []
+        walk(comments[0], 0, thread)
+        threads.append(thread)
+    return threads
+
+class TestCommentThreads(unittest.TestCase):
+
+    def test_threads(self):
+        comments = random_comments(1000)
+        # A reply that comes before its parent.
+        comments[10]['parent_id'] = 't1_' + comments[20]['id']
+        expected = naive_threads(comments)
+        self.assertEqual(expected, list(reddit_loader.comment_threads(comments)))
+
+    def test_threads_by_age(self):
+        comments = random_comments(1000)
+        expected = naive_threads(comments)
+        # Replies come within 30 minutes, so no thread is cut short.
+        threads = list(reddit_loader.comment_threads(comments, max_age=1800))
+        key = lambda thread: thread[0][1]['id']
+        self.assertEqual(sorted(expected, key=key), sorted(threads, key=key))
+        # But with a shorter age, some are.
+        threads = list(reddit_loader.comment_threads(comments, max_age=300))
+        self.assertGreater(len(threads), len(expected))
+        self.assertEqual(len(comments), sum(map(len, threads)))
+
+    def test_deep_thread(self):
+        comments = [{'id': 'c0', 'parent_id': 't3_p'}]
+        for i in range(1, 5000):
+            comments.append({'id': 'c' + str(i), 'parent_id': 't1_c' + str(i - 1)})
+        (thread,) = reddit_loader.comment_threads(comments)
+        self.assertEqual(list(enumerate(comments)), thread)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import os
+import random
+import sys
+from collections import Counter
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sketches import SpaceSaving, CountMinSketch, HyperLogLog, ValueSketch, stable_hash
+
+def zipf_words(n, seed=0):
+    rng = random.Random(seed)
+    return ['w' + str(int(1 / (1 - rng.random()))) for _ in range(n)]
+
+class TestSketches(unittest.TestCase):
+
+    def test_stable_hash(self):
+        self.assertEqual(stable_hash('hello'), stable_hash('hel' + 'lo'))
+        self.assertNotEqual(stable_hash('hello'), stable_hash('hellp'))
+        self.assertLess(stable_hash('\ud83d'), 2 ** 64)
+
+    def test_space_saving(self):
+        words = zipf_words(50000)
+        exact = Counter(words)
+        summary = SpaceSaving(50)
+        for i in range(0, len(words), 1000):
+            summary.update(Counter(words[i:i + 1000]))
+        self.assertEqual(len(words), summary.total)
+        self.assertLessEqual(summary.floor, len(words) / 50)
+        for (word, n) in summary.counts.items():
+            self.assertGreaterEqual(n, exact[word])
+            self.assertLessEqual(n, exact[word] + summary.floor)
+        for (word, n) in exact.items():
+            if n > summary.floor:
+                self.assertIn(word, summary.counts)
+        self.assertEqual([w for (w, _) in exact.most_common(10)], [w for (w, _) in summary.top(10)])
+
+    def test_merge(self):
+        words = zipf_words(50000)
+        exact = Counter(words)
+        (merged, part) = (SpaceSaving(50), SpaceSaving(50))
+        merged.update(Counter(words[:20000]))
+        part.update(Counter(words[20000:]))
+        merged.merge(part)
+        self.assertEqual(len(words), merged.total)
+        for (word, n) in merged.counts.items():
+            self.assertGreaterEqual(n, exact[word])
+            self.assertLessEqual(n, exact[word] + merged.floor)
+        (sketch, part) = (CountMinSketch(100, 2), CountMinSketch(100, 2))
+        sketch.update(Counter(words[:20000]))
+        part.update(Counter(words[20000:]))
+        whole = CountMinSketch(100, 2)
+        whole.update(exact)
+        sketch.merge(part)
+        self.assertEqual(whole.rows, sketch.rows)
+        with self.assertRaises(ValueError):
+            sketch.merge(CountMinSketch(100, 3))
+
+    def test_count_min_sketch(self):
+        words = zipf_words(20000)
+        exact = Counter(words)
+        sketch = CountMinSketch(width=1000, depth=4)
+        sketch.update(exact)
+        sketch.add('extra', 3)
+        self.assertEqual(len(words) + 3, sketch.total)
+        for (word, n) in exact.items():
+            self.assertGreaterEqual(sketch.estimate(word), n)
+        errors = [sketch.estimate(word) - n for (word, n) in exact.items()]
+        self.assertLess(sum(errors) / len(errors), 2.72 * sketch.total / 1000)
+
+    def test_hyper_log_log(self):
+        for n in (0, 10, 1000, 50000):
+            hll = HyperLogLog()
+            for i in range(n):
+                hll.add(str(i))
+                hll.add(str(i))
+            self.assertAlmostEqual(n, hll.estimate(), delta=0.03 * n)
+        (hll, other) = (HyperLogLog(10), HyperLogLog(10))
+        for i in range(20000):
+            (hll if i % 3 else other).add(str(i))
+        hll.merge(other)
+        self.assertAlmostEqual(20000, hll.estimate(), delta=0.1 * 20000)
+        with self.assertRaises(ValueError):
+            hll.merge(HyperLogLog(11))
+
+    def test_value_sketch(self):
+        values = [int(w[1:]) for w in zipf_words(50000)]
+        exact = Counter(values)
+        sketch = ValueSketch(top=5, batch_size=100)
+        for value in values[:25000]:
+            sketch.add(value)
+        other = ValueSketch(top=5)
+        other.update(Counter(values[25000:]))
+        sketch.merge(other)
+        self.assertAlmostEqual(len(exact), sketch.count_distinct(), delta=0.03 * len(exact))
+        self.assertEqual([v for (v, _) in exact.most_common(5)], [v for (v, _) in sketch.top(5)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from stores import BloomFilter, GrowingBloomFilter, SpillingDict, EvictingDict
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000)
+        for i in range(1000):
+            bloom.add('c' + str(i))
+        for i in range(1000):
+            self.assertIn('c' + str(i), bloom)
+        false_positives = sum(('x' + str(i)) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_growing_bloom_filter(self):
+        bloom = GrowingBloomFilter(100)
+        for i in range(10000):
+            bloom.add('c' + str(i))
+        self.assertGreater(len(bloom.filters), 1)
+        for i in range(10000):
+            self.assertIn('c' + str(i), bloom)
+        false_positives = sum(('x' + str(i)) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+class TestSpillingDict(unittest.TestCase):
+
+    def test_spilling_dict(self):
+        with SpillingDict(max_items=10) as d:
+            for i in range(100):
+                d['c' + str(i)] = {'body': 'comment ' + str(i)}
+            self.assertLessEqual(len(d.recent), 10)
+            self.assertGreater(d.spill_count, 0)
+            for i in range(100):
+                key = 'c' + str(i)
+                self.assertIn(key, d)
+                self.assertEqual({'body': 'comment ' + str(i)}, d[key])
+            self.assertNotIn('c100', d)
+            with self.assertRaises(KeyError):
+                d['c100']
+            d['c0'] = None
+            self.assertIsNone(d['c0'])
+            path = d.path
+        self.assertFalse(os.path.exists(path))
+
+class TestEvictingDict(unittest.TestCase):
+
+    def test_max_items(self):
+        d = EvictingDict(max_items=10)
+        for i in range(100):
+            d['c' + str(i)] = i
+        self.assertEqual(10, len(d))
+        self.assertEqual(99, d['c99'])
+        self.assertIn('c90', d)
+        self.assertNotIn('c89', d)
+        self.assertNotIn('x', d)
+        self.assertEqual(1, d.lost)
+        self.assertEqual(90, d.evicted_count)
+
+    def test_not_ids(self):
+        d = EvictingDict(max_items=1)
+        d['t3abc'] = 1
+        d['t3_x'] = 2
+        d['c1'] = 3
+        # Not IDs, so not lost (even though 't3abc' and 't3_x' were evicted).
+        self.assertNotIn('t3_abc', d)
+        self.assertNotIn('t3_x', d)
+        self.assertEqual(0, d.lost)
+        self.assertIn('c1', d)
+        self.assertNotIn('t3abc', d)
+        self.assertEqual(1, d.lost)
+
+    def test_max_age(self):
+        d = EvictingDict(max_age=10)
+        for t in range(100):
+            d.advance(t)
+            d['c' + str(t)] = t
+        # Time going back a bit doesn't matter.
+        d.advance(50)
+        self.assertEqual(11, len(d))
+        self.assertIn('c89', d)
+        self.assertNotIn('c88', d)
+        self.assertEqual(1, d.lost)
+
+if __name__ == '__main__':
+    unittest.main()
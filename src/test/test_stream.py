@@ -1,5 +1,6 @@
 import unittest
 import os
+import random
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from stream import Stream
@@ -32,6 +33,28 @@ class TestStream(unittest.TestCase):
         expected = list(range(10))
         self.assertEqual(expected, items)
 
+    def test_batch(self):
+        result = Stream(range(7)).batch(3).to_list()
+        self.assertEqual([[0,1,2], [3,4,5], [6]], result)
+
+    def test_map_batches(self):
+        double_all = lambda xs: [x*2 for x in xs]
+        result = Stream(range(7)).map_batches(double_all, 3).to_list()
+        self.assertEqual([0,2,4,6,8,10,12], result)
+
+    def test_filter_batches(self):
+        even = lambda xs: [x % 2 == 0 for x in xs]
+        result = Stream(range(7)).filter_batches(even, 2).to_list()
+        self.assertEqual([0,2,4,6], result)
+
+    def test_parallel_map(self):
+        offset = 3
+        plus_offset = lambda x: x + offset    # A closure, so it can't be pickled.
+        result = Stream(range(1000)).parallel_map(plus_offset, workers=3, chunksize=7).to_list()
+        self.assertEqual(list(range(3, 1003)), result)
+        result = Stream(range(1000)).parallel_map(plus_offset, workers=3, ordered=False).to_list()
+        self.assertEqual(list(range(3, 1003)), sorted(result))
+
     def test_foreach(self):
         items = []
         def f(x):
@@ -88,5 +111,54 @@ class TestStream(unittest.TestCase):
         expected = 4 + 0 + 1 + 2
         self.assertEqual(expected, result)
 
+class TestFusion(unittest.TestCase):
+
+    def random_pipeline(self, rng, stream, seen):
+        steps = [
+            lambda s: s.map(lambda x: x + 1),
+            lambda s: s.map(lambda x: x * 3),
+            lambda s: s.filter(lambda x: x % 2 == 0),
+            lambda s: s.peek(seen.append),
+            lambda s: s.take(rng.randint(0, 40)),
+            lambda s: s.drop(rng.randint(0, 5)),
+            lambda s: s.take_while(lambda x: x < 150),
+            lambda s: s.drop_while(lambda x: x < 10),
+        ]
+        for _ in range(rng.randint(1, 8)):
+            stream = rng.choice(steps)(stream)
+        return stream
+
+    def run_pipelines(self, seed, fusion, terminal):
+        rng = random.Random(seed)
+        seen = []
+        Stream.fusion = fusion
+        try:
+            stream = self.random_pipeline(rng, Stream(range(100)), seen)
+            return (terminal(stream), seen)
+        finally:
+            Stream.fusion = True
+
+    def test_fused_same_as_chained(self):
+        terminals = [Stream.to_list, Stream.count,
+                     lambda s: s.foreach(lambda x: None)]
+        for seed in range(200):
+            for terminal in terminals:
+                expected = self.run_pipelines(seed, False, terminal)
+                result = self.run_pipelines(seed, True, terminal)
+                # Fused takes don't pull in an extra element, so peeks
+                # before a take may see one element less.
+                self.assertEqual(expected[0], result[0])
+                self.assertEqual(result[1], expected[1][:len(result[1])])
+
+    def test_take_stops_early(self):
+        items = []
+        Stream(range(10)).peek(items.append).take(3).count()
+        self.assertEqual([0,1,2], items)
+
+    def test_continue_after_partial_consumption(self):
+        s = Stream(range(10)).map(lambda x: x * 2)
+        self.assertEqual(0, next(s))
+        self.assertEqual([4, 6], s.drop(1).take(2).to_list())
+
 if __name__ == '__main__':
     unittest.main()
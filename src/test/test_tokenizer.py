@@ -0,0 +1,59 @@
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from tokenizer import Tokenizer
+
+class TestTokenizer(unittest.TestCase):
+
+    def test_words_and_punctuation(self):
+        self.assertEqual(['Hello', ',', 'world', '!'], Tokenizer()('Hello, world!'))
+        self.assertEqual(['Hello', 'world'], Tokenizer(keep_punctuation=False)('Hello, world!'))
+        self.assertEqual(['pi', 'is', '3.14', ',', 'not', '1,000'], Tokenizer()('pi is 3.14, not 1,000'))
+        self.assertEqual([], Tokenizer()(''))
+
+    def test_contractions(self):
+        tokenize = Tokenizer()
+        self.assertEqual(['I', 'do', "n't", 'know', 'what', 'they', "'re", 'doing'],
+                         tokenize("I don't know what they're doing"))
+        self.assertEqual(['ca', "n't", 'It', "'S"], tokenize("can't It'S"))
+        self.assertEqual(["rock'n'roll"], tokenize("rock'n'roll"))
+        self.assertEqual(["don't"], Tokenizer(split_contractions=False)("don't"))
+
+    def test_urls_and_references(self):
+        tokenize = Tokenizer(lower=True)
+        self.assertEqual(['see', 'https://example.com/A_b?x=1', '.'], tokenize('See https://example.com/A_b?x=1.'))
+        self.assertEqual(['this', 'http://foo.org/bar', ')'], tokenize('[this](http://foo.org/bar)'))
+        self.assertEqual(['r/askreddit', 'by', 'u/some_user', 'r/askreddit'],
+                         tokenize('/r/AskReddit by /u/some_user r/askreddit'))
+
+    def test_markdown(self):
+        self.assertEqual(['bold', 'and', 'gone', 'quote', 'code'],
+                         Tokenizer()('**bold** and ~~gone~~\n&gt; quote `code`'))
+
+    def test_emoticons(self):
+        tokenize = Tokenizer(lower=True, keep_punctuation=False)
+        self.assertEqual(['great', ':D', '<3', 'XD', '^_^'], tokenize('Great :D <3 XD ^_^'))
+        self.assertEqual(['password'], tokenize(':Password'))
+
+    def test_interning(self):
+        tokenize = Tokenizer(lower=True)
+        [first, second] = tokenize.batch(['The cat', 'the CAT'])
+        self.assertEqual(first, second)
+        self.assertIs(first[0], second[0])
+        self.assertIs(first[1], second[1])
+        table = {}
+        tokens = Tokenizer(table=table, max_table=2)('a b c')
+        self.assertEqual(['a', 'b', 'c'], tokens)
+        self.assertEqual(2, len(table[False]))
+
+    def test_shared_table(self):
+        table = {}
+        (lower, keep_case) = (Tokenizer(lower=True, table=table), Tokenizer(table=table))
+        self.assertEqual(['the'], lower('The'))
+        self.assertEqual(['The'], keep_case('The'))
+        self.assertEqual(['the'], lower('The'))
+        self.assertIs(lower('word')[0], Tokenizer(lower=True, table=table)('word')[0])
+
+if __name__ == '__main__':
+    unittest.main()
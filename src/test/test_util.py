@@ -16,6 +16,37 @@ class TestUtil(unittest.TestCase):
         ]
         self.assertEqual(expected, lines)
 
+    def test_parallel_file_streamer(self):
+        files = ['testfile1', 'testfile2.bz2', 'testfile1']
+        expected = list(util.multi_file_streamer(*files))
+        ordered = list(util.parallel_file_streamer(*files, workers=2, batch_size=1))
+        self.assertEqual(expected, ordered)
+        unordered = list(util.parallel_file_streamer(*files, workers=2, ordered=False))
+        self.assertEqual(sorted(expected), sorted(unordered))
+
+    def test_parallel_file_streamer_missing_file(self):
+        files = ['testfile1', 'no-such-file']
+        with self.assertRaises(FileNotFoundError):
+            list(util.parallel_file_streamer(*files, workers=2))
+
+    def test_read_byte_range(self):
+        expected = list(util.read_file('testfile1'))
+        size = os.path.getsize('testfile1')
+        for n in (1, 2, 3, 7, size, 2 * size):
+            lines = []
+            for (start, end) in util.split_file('testfile1', n):
+                lines.extend(util.read_byte_range('testfile1', start, end))
+            self.assertEqual(expected, lines)
+
+    def test_prefetch(self):
+        self.assertEqual(list(range(1000)), list(util.prefetch(2, range(1000), batch_size=7)))
+        self.assertEqual([], list(util.prefetch(2, [])))
+        def fail():
+            yield 1
+            raise ValueError('oops')
+        with self.assertRaises(ValueError):
+            list(util.prefetch(2, fail(), batch_size=1))
+
     def test_compose(self):
         add2 = lambda x: x + 2
         times3 = lambda x: x*3
@@ -45,6 +76,20 @@ class TestUtil(unittest.TestCase):
         result = g(comment)
         self.assertEqual(expected, result)
 
+    def test_wrap_batch(self):
+        g = util.wrap_batch(str.upper)
+        comments = [{'body': 'hello', 'id': 'c1'}, {'body': 'bye', 'id': 'c2'}]
+        expected = [{'body': 'HELLO', 'id': 'c1'}, {'body': 'BYE', 'id': 'c2'}]
+        self.assertEqual(expected, g(comments))
+
+    def test_batch(self):
+        self.assertEqual([[0,1], [2,3], [4]], list(util.batch(2, range(5))))
+        self.assertEqual([], list(util.batch(2, [])))
+
+    def test_batched(self):
+        square = util.batched(lambda x: x*x)
+        self.assertEqual([1,4,9], square([1,2,3]))
+
     def test_foreach(self):
         items = []
         def f(x):
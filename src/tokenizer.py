@@ -0,0 +1,86 @@
+import re
+
+"""
+A tokenizer for reddit comments.
+
+`str.split` leaves punctuation stuck to words ('bar!' and 'bar' are different
+words), and NLTK's `word_tokenize` is very slow. `Tokenizer` does a single
+`findall` of one regex per comment, which knows about:
+- URLs (kept whole, without trailing punctuation),
+- /r/subreddit and /u/user references (as 'r/subreddit' and 'u/user'),
+- markdown (emphasis, strikethrough, code, quotes, headers and link brackets
+  are dropped) and the HTML entities reddit escapes bodies with,
+- contractions, split like NLTK does ("don't" -> 'do', "n't"),
+- emoticons (kept whole, and not lowercased),
+- numbers with separators ('3.14', '1,000', '10:30').
+
+Comments repeat the same few thousand words over and over, so every token is
+looked up in a table of the tokens seen before, and replaced by the string
+from the table. That way the tokens of millions of comments share a few
+strings rather than each being a new one, and the lookup also caches the
+lowercasing. An `Encoder` keeps the first string it sees for each word, so
+its vocabulary then shares the strings too.
+"""
+
+EMOTICONS = [':-)', ':)', ':-(', ':(', ':-D', ':D', ';-)', ';)', ':-P', ':P', ':-p', ':p', ':-/', ':/',
+             ':|', ":'(", ':O', ':o', '=)', '=(', '<3', '</3', 'xD', 'XD', '^_^', '^^', '-_-', 'o_O', 'O_o']
+
+# Each alternative starts with a lookahead for its possible first characters,
+# which fails a lot faster than trying the whole alternative.
+URL = r'(?=[hw])(?:https?://|www\.)[^\s<>"\[\]()]*[^\s<>"\[\]().,;:!?\'*]'
+REFERENCE = r'(?=[/ru])(?<![\w/])/?[ru]/[\w-]+'
+EMOTICON = ('(?=[' + ''.join(sorted(set(re.escape(e[0]) for e in EMOTICONS))) + '])(?:'
+            + '|'.join(re.escape(e) for e in sorted(EMOTICONS, key=len, reverse=True)) + r')(?!\w)')
+NUMBER = r'(?=\d)\d+(?:[.,:]\d+)+'
+CLITIC = r"(?i:n['’]t|['’](?:s|m|d|ll|re|ve))\b"
+STEM = r"(?=[^\W_]+['’])[^\W_]+(?=" + CLITIC + ')'
+WORD = r"[^\W_]+(?:['’][^\W_]+)*"
+MARKUP = r'(?=[*~`^#>_\[\]&])(?!' + EMOTICON + r')(?:&(?:gt|lt|amp|nbsp|quot|#x200[bB]);|\]\(|[*~`^#>_\[\]]+)'
+PUNCTUATION = r'[^\w\s]'
+
+def _pattern(keep_punctuation, split_contractions):
+    # The tokens are in the (single) group, so findall returns '' for the
+    # markup (and punctuation) it skips.
+    tokens = [URL, REFERENCE, EMOTICON, NUMBER] + ([STEM, CLITIC] if split_contractions else []) + [WORD]
+    if keep_punctuation:
+        return re.compile(MARKUP + '|(' + '|'.join(tokens + [PUNCTUATION]) + ')')
+    return re.compile(MARKUP + '|(' + '|'.join(tokens) + ')|' + PUNCTUATION)
+
+class Tokenizer:
+    """
+    Splits texts into lists of tokens (see above). Tokens are lowercased if
+    lower (except emoticons and URLs), and punctuation is dropped unless
+    keep_punctuation. The known tokens (a dict, from tokens as they appear
+    in the text to the normalized ones, which stops growing at max_table
+    entries) can be shared through table, a dict with one such dict for each
+    setting of lower (since that changes what the tokens normalize to).
+    """
+
+    def __init__(self, lower=False, keep_punctuation=True, split_contractions=True, table=None,
+                 max_table=1000000):
+        self.lower = lower
+        self.findall = _pattern(keep_punctuation, split_contractions).findall
+        self.table = ({} if table is None else table).setdefault(bool(lower), {})
+        self.max_table = max_table
+
+    def _normalize(self, raw):
+        """The string from the table for a token that isn't in it yet."""
+        (table, token) = (self.table, raw)
+        if raw.startswith('/') and len(raw) > 1:
+            token = raw[1:]
+        if self.lower and raw not in EMOTICONS and not re.match(URL, raw):
+            token = token.lower()
+        token = table.get(token, token)
+        if len(table) < self.max_table:
+            table[token] = token
+            table[raw] = token
+        return token
+
+    def __call__(self, text):
+        get = self.table.get
+        return [get(token) or self._normalize(token) for token in self.findall(text) if token]
+
+    def batch(self, texts):
+        """Tokenize each of the texts, returning a list of lists of tokens."""
+        (findall, get, normalize) = (self.findall, self.table.get, self._normalize)
+        return [[get(token) or normalize(token) for token in findall(text) if token] for text in texts]
@@ -1,4 +1,12 @@
 import bz2
+import gzip
+import os
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from itertools import islice
+from bz2_blocks import open_bz2_parallel
 
 def concat(*iterables):
     """Concatenates an arbitrary number of generators/iterables."""
@@ -6,20 +14,161 @@ def concat(*iterables):
         for e in it:
             yield e
 
-def read_file(filename):
+def read_file(filename, workers=1):
     """
     Like the built-in `open(filename, 'r')`, but can read bz2-compressed
-    files as well as plain text. Compressed files must end in '.bz2'.
+    files as well as plain text. Compressed files must end in '.bz2' (or in
+    '.gz', for gzip, which is what `partition` writes).
+    With workers > 1, the blocks of a bz2-compressed file are decompressed in
+    parallel (see `bz2_blocks`).
     """
     bzipped = filename.endswith('.bz2')
+    if bzipped and workers > 1:
+        return open_bz2_parallel(filename, workers)
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
     return bz2.open(filename, 'rt') if bzipped else open(filename, 'r')
 
-def multi_file_streamer(*filenames):
+def split_file(filename, n):
+    """
+    Splits a file into n byte ranges (start, end) of (about) equal size,
+    for `read_byte_range`.
+    """
+    size = os.path.getsize(filename)
+    return [(i * size // n, (i + 1) * size // n) for i in range(n)]
+
+def read_byte_range(filename, start, end):
+    """
+    The lines of a (plain text) file that start at a byte in range(start,
+    end). So the ranges from `split_file` together give every line exactly
+    once, even though they don't start or end on line boundaries.
+    """
+    with open(filename, 'rb') as f:
+        if start > 0:
+            # Skip the rest of the line that started before start (if any).
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+        while start < end:
+            line = f.readline()
+            if not line:
+                break
+            start += len(line)
+            yield line.decode('utf-8')
+
+def multi_file_streamer(*filenames, workers=1, ordered=True):
     """
     Can open multiple (possibly bz2-compressed) files as though they were one
     single large file.
+    With workers > 1, multiple files are read in parallel (see
+    `parallel_file_streamer`), and a single bz2-compressed file is
+    decompressed block by block in parallel instead (see `read_file`).
+    """
+    if workers > 1 and len(filenames) > 1:
+        return parallel_file_streamer(*filenames, workers=workers, ordered=ordered)
+    return concat(*(read_file(filename, workers) for filename in filenames))
+
+def _file_reader(filename, queue, batch_size):
+    """
+    Worker process for `parallel_file_streamer`. Reads a file and puts its
+    lines on the queue in batches, followed by None when done. An exception
+    is passed on to the reading side rather than lost in the worker.
+    """
+    try:
+        with read_file(filename) as f:
+            batch = []
+            for line in f:
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    queue.put(batch)
+                    batch = []
+            if batch:
+                queue.put(batch)
+    except Exception as e:
+        queue.put(e)
+    queue.put(None)
+
+def _start_reader(filename, queue, batch_size):
+    process = multiprocessing.Process(target=_file_reader,
+            args=(filename, queue, batch_size), daemon=True)
+    process.start()
+    return process
+
+def _ordered_file_streamer(filenames, workers, batch_size, queue_size):
+    # Each file gets its own queue, and the queues are drained in file order.
+    # Files further ahead are decompressed in the background until their queue
+    # is full, so at most `workers` files are being read at any time.
+    pending = deque(filenames)
+    running = deque()   # (process, queue)
+    def start_next():
+        queue = multiprocessing.Queue(queue_size)
+        running.append((_start_reader(pending.popleft(), queue, batch_size), queue))
+    try:
+        while pending and len(running) < workers:
+            start_next()
+        while running:
+            (process, queue) = running[0]
+            for batch in iter(queue.get, None):
+                if isinstance(batch, Exception):
+                    raise batch
+                for line in batch:
+                    yield line
+            process.join()
+            running.popleft()
+            if pending:
+                start_next()
+    finally:
+        for (process, _) in running:
+            process.terminate()
+
+def _unordered_file_streamer(filenames, workers, batch_size, queue_size):
+    # All workers share a single queue, so batches arrive in whatever order
+    # the workers manage to produce them.
+    pending = deque(filenames)
+    running = []
+    queue = multiprocessing.Queue(queue_size)
+    def start_next():
+        running.append(_start_reader(pending.popleft(), queue, batch_size))
+    try:
+        while pending and len(running) < workers:
+            start_next()
+        active = len(running)
+        while active > 0:
+            batch = queue.get()
+            if batch is None:
+                active -= 1
+                if pending:
+                    start_next()
+                    active += 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                for line in batch:
+                    yield line
+    finally:
+        for process in running:
+            process.terminate()
+
+def parallel_file_streamer(*filenames, workers=None, ordered=True, batch_size=1000, queue_size=16):
+    """
+    Like `multi_file_streamer`, but each file is read (and decompressed) in a
+    separate worker process, so reading many bz2-compressed files can use
+    more than one core.
+
+    Lines are passed back in batches of `batch_size` lines through bounded
+    queues (at most `queue_size` batches per queue), so a worker that gets
+    ahead of the consumer simply waits instead of filling up memory.
+    At most `workers` files are read at the same time (default: one per CPU).
+
+    When ordered is true, the lines come out exactly as with
+    `multi_file_streamer` (file by file, in the order given). Otherwise lines
+    are yielded as soon as any worker has produced them, which is faster but
+    interleaves the files. That is fine for things like counting, but not for
+    anything that expects replies to come after the comments they reply to.
     """
-    return concat(*map(read_file, filenames))
+    workers = workers or os.cpu_count() or 1
+    if ordered:
+        return _ordered_file_streamer(filenames, workers, batch_size, queue_size)
+    return _unordered_file_streamer(filenames, workers, batch_size, queue_size)
 
 def wrap(f, key='body'):
     """
@@ -47,6 +196,78 @@ def wrap(f, key='body'):
         return comment
     return g
 
+def wrap_batch(f, key='body'):
+    """
+    Like `wrap`, but the returned function operates on a list of comments
+    (mutating each of them) rather than a single comment. Meant for
+    `Stream.map_batches`, where it saves a function call per comment.
+    """
+    def g(comments):
+        for comment in comments:
+            comment[key] = f(comment[key])
+        return comments
+    return g
+
+def batched(f):
+    """
+    Turn a function f: A->B into a function [A]->[B] (applying f to each
+    element). Can be used to turn any function into one for
+    `Stream.map_batches`, or a predicate into one for `Stream.filter_batches`.
+    """
+    return lambda xs: list(map(f, xs))
+
+def batch(n, it):
+    """Group the items into lists of n items (the last one may be shorter)."""
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+def prefetch(n, it, batch_size=1000):
+    """
+    Iterate over it on a background thread, up to n batches (of batch_size
+    items) ahead of the consumer.
+
+    Only one thread runs Python code at a time, but decompression and file
+    reads release the GIL, so if it is reading (and decompressing) a file,
+    that can happen while the consumer is busy parsing and processing.
+    Exceptions in the background thread are raised in the consumer.
+    """
+    buffer = queue.Queue(n)
+    stop = threading.Event()
+    def put(item):
+        # Give up if the consumer is gone, rather than blocking forever.
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for chunk in batch(batch_size, it):
+                if not put(chunk):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = buffer.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            for x in chunk:
+                yield x
+    finally:
+        stop.set()
+
 def take(n, it):
     """Take an iterator and truncate it to at most n elements."""
     for (count, item) in enumerate(it):
@@ -0,0 +1,80 @@
+import os
+import queue
+import multiprocessing
+from collections import deque
+
+def bounded_imap(pool, f, iterable, window, ordered=True):
+    """
+    Like `pool.imap(f, iterable)` (or `imap_unordered` when ordered is false),
+    but with at most `window` tasks in flight at any time.
+
+    `Pool.imap` eagerly consumes its input and keeps every result it has
+    computed until it is asked for it, so a slow consumer of a fast pool (or
+    a pool fed by a huge input stream) ends up holding everything in memory.
+    Here, no new task is submitted until the oldest (ordered) or any
+    (unordered) result has been handed over, so memory stays flat.
+    """
+    if ordered:
+        pending = deque()
+        for x in iterable:
+            pending.append(pool.apply_async(f, (x,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    else:
+        done = queue.Queue()
+        def on_result(result):
+            done.put((True, result))
+        def on_error(e):
+            done.put((False, e))
+        def next_result():
+            (ok, result) = done.get()
+            if not ok:
+                raise result
+            return result
+        in_flight = 0
+        for x in iterable:
+            pool.apply_async(f, (x,), callback=on_result, error_callback=on_error)
+            in_flight += 1
+            if in_flight >= window:
+                in_flight -= 1
+                yield next_result()
+        while in_flight > 0:
+            in_flight -= 1
+            yield next_result()
+
+# The function applied by `parallel_map`, in the worker processes.
+_function = None
+
+def _set_function(f):
+    global _function
+    _function = f
+
+def _apply_to_chunk(chunk):
+    return list(map(_function, chunk))
+
+def parallel_map(f, it, workers=None, chunksize=100, ordered=True, window=None):
+    """
+    Like `map(f, it)`, but f is applied in a pool of worker processes
+    (default: one per CPU), chunksize elements at a time. At most window
+    chunks (default: twice the number of workers) are in flight, so this
+    works on arbitrarily long input.
+
+    The workers are forked, and f is passed on through the fork rather than
+    pickled, so f can be a lambda or a closure. The elements and results do
+    have to be picklable. Since f runs in another process, any side effects
+    it has (like updating an accumulator) are lost.
+
+    With ordered=False, chunks are yielded in whatever order they finish.
+    """
+    # Not imported at the top: util imports this module (through bz2_blocks).
+    from util import batch
+    workers = workers or os.cpu_count() or 1
+    window = window or 2 * workers
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers, initializer=_set_function, initargs=(f,)) as pool:
+        chunks = batch(chunksize, it)
+        for chunk in bounded_imap(pool, _apply_to_chunk, chunks, window, ordered):
+            for x in chunk:
+                yield x